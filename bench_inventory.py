@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# bench_inventory.py - Time inventory rendering for growing cluster sizes
+#
+# Copyright © 2018 Red Hat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import argparse
+import io
+import ipaddress
+import os
+import time
+import create_inventory
+
+# CONSTANTS
+
+DEFAULT_SIZES = "10 100 1000 5000"
+DEFAULT_REPEAT = 5
+# share of the nodes that are infra nodes
+INFRA_RATIO = 0.1
+
+
+def make_args(size):
+    """ Command line arguments of a cluster with `size` nodes (besides the master) """
+    hosts = ipaddress.ip_network('10.0.0.0/16').hosts()
+    master = str(next(hosts))
+    infra_count = max(1, int(size * INFRA_RATIO))
+    infra = [str(next(hosts)) for _ in range(infra_count)]
+    compute = [str(next(hosts)) for _ in range(max(1, size - infra_count))]
+    args = create_inventory.build_parser().parse_args([
+        '--name-prefix=bench',
+        '--master-ip=' + master,
+        '--infra-ips=' + " ".join(infra),
+        '--compute-ips=' + " ".join(compute),
+        '--nfs-server=nfs.example.com',
+        '--nfs-export-path=/exports'])
+    return master, infra, compute, args
+
+
+def peak_memory(func):
+    """ Run func, return the peak of the memory it allocated (in bytes), None if unknown """
+    try:
+        import tracemalloc
+    except ImportError:
+        # python2
+        func()
+        return None
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench(size, repeat, templates):
+    """ Return (best seconds, peak memory) of writing an inventory with `size` nodes """
+    master, infra, compute, args = make_args(size)
+
+    def write():
+        with io.open(os.devnull, 'w') as out:
+            create_inventory.write_inventory(out, master, infra, compute, args, templates)
+
+    best = None
+    for _ in range(repeat):
+        started = time.time()
+        write()
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, peak_memory(write)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time inventory rendering for growing cluster sizes')
+    parser.add_argument('--sizes', type=str, default=DEFAULT_SIZES,
+                        help="Space separated node counts")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help="Runs per size, the best run is reported")
+    args = parser.parse_args()
+
+    templates = create_inventory.TemplateSet()
+    line = "{0:>6} {1:>10} {2:>10} {3:>12}"
+    print(line.format("nodes", "ms", "us/node", "peak KiB"))
+    for size in [int(s) for s in args.sizes.split()]:
+        seconds, peak = bench(size, args.repeat, templates)
+        print(line.format(size, "%.2f" % (seconds * 1000), "%.1f" % (seconds * 1e6 / size),
+                          "-" if peak is None else "%.1f" % (peak / 1024.0)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# bench_vm_creator.py - Benchmark cm_ovirt_vm_creator against the fake engine
+#
+# Copyright © 2018 Red Hat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import cm_ovirt_vm_creator
+import fake_engine
+import timing
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+# CONSTANTS
+
+PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE_PATH = os.path.join(PATH, "bench_vm_creator_baseline.json")
+DEFAULT_SIZES = "5 50 500"
+# A metric regresses when it grows by more than this share of the baseline
+DEFAULT_TOLERANCE = 0.25
+# ... and, for the wall clock time, by more than this many seconds
+SECONDS_SLACK = 1.0
+METRICS = ["seconds", "requests", "peak_kib"]
+# (scenario, creator arguments), run in this order on the same engine
+SCENARIOS = [("create_vms", []), ("get_vms_info", ["--info"]), ("destroy_vms", ["--destroy"])]
+
+
+def serve_engine(queue, engine_args):
+    """ Run the fake engine, in its own process so it doesn't count in the measured memory """
+    server = fake_engine.Server(("127.0.0.1", 0), fake_engine.engine_from_args(engine_args))
+    queue.put(server.url)
+    server.serve_forever()
+
+
+def engine_requests(url):
+    """ Number of requests the engine served so far """
+    stats_url = url[:-len(fake_engine.API_PATH)] + fake_engine.STATS_PATH
+    return sum(json.loads(urlopen(stats_url).read().decode("utf-8")).values())
+
+
+def node_counts(size):
+    """ (masters, infra nodes, compute nodes) of a cluster of `size` VMs """
+    infra = max(1, size // 10)
+    return 1, infra, size - 1 - infra
+
+
+def creator_args(url, ca_file, size, extra_args):
+    masters, infra, compute = node_counts(size)
+    argv = ['--ovirt-url', url, '--ovirt-user', 'admin@internal', '--ovirt-ca-pem-file', ca_file,
+            '--ovirt-token-cache', '',
+            '--name-prefix', 'bench', '--ovirt-cluster', 'Default', '--ovirt-template', 'bench',
+            '--masters', str(masters), '--infra-nodes', str(infra), '--nodes', str(compute),
+            '--sleep-between-iterations', '1']
+    return cm_ovirt_vm_creator.build_parser().parse_args(argv + extra_args)
+
+
+def measure(func):
+    """ Run func, return (seconds, peak allocated KiB or None) """
+    try:
+        import tracemalloc
+    except ImportError:
+        # python2
+        tracemalloc = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+    started = time.time()
+    try:
+        func()
+    finally:
+        seconds = time.time() - started
+        peak = None
+        if tracemalloc is not None:
+            peak = tracemalloc.get_traced_memory()[1] / 1024.0
+            tracemalloc.stop()
+    return seconds, peak
+
+
+def run_quietly(name, args):
+    """ Run the creator with its (per VM) output thrown away """
+    cm_ovirt_vm_creator.tracer = timing.Tracer()
+    stdout, stderr = sys.stdout, sys.stderr
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = sys.stderr = devnull
+        try:
+            cm_ovirt_vm_creator.run(args)
+        except SystemExit:
+            raise Exception("cm_ovirt_vm_creator gave up on {0} of {1}".format(name, args.name_prefix))
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+
+def bench_size(size, engine_args, extra_args, ca_file):
+    """ Create a cluster of `size` VMs on a fresh engine, get its info and destroy it; return the results """
+    queue = multiprocessing.Queue()
+    engine = multiprocessing.Process(target=serve_engine, args=(queue, engine_args))
+    engine.daemon = True
+    engine.start()
+    try:
+        url = queue.get(timeout=10)
+        results = {}
+        for name, mode_args in SCENARIOS:
+            args = creator_args(url, ca_file, size, extra_args + mode_args)
+            before = engine_requests(url)
+            seconds, peak = measure(lambda: run_quietly(name, args))
+            results["{0}/{1}".format(name, size)] = {"seconds": seconds,
+                                                     "requests": engine_requests(url) - before,
+                                                     "peak_kib": peak}
+        return results
+    finally:
+        engine.terminate()
+        engine.join()
+
+
+def regressions(results, baseline, tolerance):
+    """ Return the (scenario, metric, baseline, result) that grew beyond the tolerance """
+    ret = []
+    for scenario, values in sorted(results.items()):
+        for metric in METRICS:
+            base = baseline.get(scenario, {}).get(metric)
+            value = values[metric]
+            if base is None or value is None:
+                continue
+            limit = base * (1 + tolerance)
+            if metric == "seconds":
+                limit = max(limit, base + SECONDS_SLACK)
+            if value > limit:
+                ret.append((scenario, metric, base, value))
+    return ret
+
+
+def print_results(results, baseline):
+    line = "{0:<20} {1:>10} {2:>10} {3:>10} {4:>10} {5:>12} {6:>12}"
+    print(line.format("scenario", "seconds", "baseline", "requests", "baseline", "peak KiB", "baseline"))
+
+    def fmt(value, pattern):
+        return "-" if value is None else pattern % value
+
+    def order(item):
+        name, size = item[0].split("/")
+        return name, int(size)
+
+    for scenario, values in sorted(results.items(), key=order):
+        base = baseline.get(scenario, {})
+        print(line.format(scenario,
+                          fmt(values["seconds"], "%.2f"), fmt(base.get("seconds"), "%.2f"),
+                          fmt(values["requests"], "%d"), fmt(base.get("requests"), "%d"),
+                          fmt(values["peak_kib"], "%.1f"), fmt(base.get("peak_kib"), "%.1f")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cm_ovirt_vm_creator against the fake engine')
+    parser.add_argument('--sizes', nargs='?', type=str, default=DEFAULT_SIZES,
+                        help="Space separated cluster sizes")
+    parser.add_argument('--creator-args', nargs='?', type=str, default="",
+                        help="Extra cm_ovirt_vm_creator arguments, given with an '=' since they start "
+                             "with dashes (e.g. --creator-args='--adaptive --use-events')")
+    parser.add_argument('--baseline', nargs='?', type=str, default=DEFAULT_BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Store the results as the new baseline")
+    parser.add_argument('--tolerance', nargs='?', type=float, default=DEFAULT_TOLERANCE,
+                        help="Growth over the baseline reported as a regression")
+    fake_engine.add_engine_args(parser)
+    args = parser.parse_args()
+
+    # the creator reads these from the environment
+    os.environ.setdefault(cm_ovirt_vm_creator.ovirt_utils.DEFAULT_OVIRT_PASS_ENV_VAR, "fake")
+    os.environ.setdefault(cm_ovirt_vm_creator.DEFAULT_OVIRT_PUB_SSHKEY_ENV_VAR, "ssh-rsa fake")
+    engine_settings = dict((key, getattr(args, key)) for key in
+                           ("latency", "lock_delay", "boot_delay", "ip_delay", "failure_rate", "seed"))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            stored = json.load(f)
+        if stored.get("engine") != engine_settings or stored.get("creator_args") != args.creator_args:
+            print("WARNING - the baseline was measured with other engine settings or creator arguments",
+                  file=sys.stderr)
+        baseline = stored.get("results", {})
+
+    # the SDK wants a CA file, even though the fake engine speaks plain HTTP
+    with tempfile.NamedTemporaryFile(suffix=".pem") as ca_file:
+        results = {}
+        for size in [int(s) for s in args.sizes.split()]:
+            print("benchmarking {0} nodes...".format(size), file=sys.stderr)
+            results.update(bench_size(size, args, args.creator_args.split(), ca_file.name))
+
+    print_results(results, baseline)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"engine": engine_settings, "creator_args": args.creator_args, "results": results},
+                      f, indent=1, sort_keys=True)
+        print("baseline saved to {0}".format(args.baseline))
+        return
+
+    found = regressions(results, baseline, args.tolerance)
+    for scenario, metric, base, value in found:
+        print("REGRESSION - {0} {1}: {2:.1f} -> {3:.1f}".format(scenario, metric, base, value))
+    if found:
+        raise SystemExit("{0} regressions over the baseline".format(len(found)))
+
+
+if __name__ == "__main__":
+    main()
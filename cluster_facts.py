@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# cluster_facts.py - Collect the cluster facts ManageIQ's provider setup needs
+#
+# Copyright © 2018 Red Hat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import argparse
+import json
+import os
+import sys
+import node_prep
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+# CONSTANTS
+
+SECTION_MARKER = "==> cluster_facts:{0} <=="
+# (section, command) run on the master in a single batch
+FACT_COMMANDS = [("routes", "oc get route --all-namespaces -o json"),
+                 ("nodes", "oc get nodes -o name"),
+                 ("token", "oc sa get-token -n management-infra management-admin"),
+                 ("ca_crt", "cat /etc/origin/master/ca.crt")]
+# fact -> (namespace, route name)
+ROUTE_FACTS = {"OPENSHIFT_HAWKULAR_ROUTE": ("openshift-infra", "hawkular-metrics"),
+               "OPENSHIFT_PROMETHEUS_ALERTS_ROUTE": ("openshift-metrics", "alerts"),
+               "OPENSHIFT_PROMETHEUS_METRICS_ROUTE": ("openshift-metrics", "prometheus"),
+               "OPENSHIFT_CFME_ROUTE": ("openshift-management", "httpd")}
+
+
+def batch_script():
+    """ Shell script printing the output of all the FACT_COMMANDS, each after its marker """
+    parts = ["echo '{0}'; {1} 2>/dev/null".format(SECTION_MARKER.format(section), command)
+             for section, command in FACT_COMMANDS]
+    # a missing component leaves its section empty, like it did for the single commands
+    return "; ".join(parts) + "; true"
+
+
+def split_sections(output):
+    """ Split the batch output into {section: text} """
+    markers = dict((SECTION_MARKER.format(section), section) for section, _ in FACT_COMMANDS)
+    sections = {}
+    current = None
+    for line in output.splitlines():
+        if line in markers:
+            current = markers[line]
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+    return dict((section, "\n".join(lines).strip()) for section, lines in sections.items())
+
+
+def parse_facts(sections):
+    """ Build the facts from the batch output sections """
+    hosts = {}
+    if sections.get("routes"):
+        for route in json.loads(sections["routes"]).get("items", []):
+            metadata = route.get("metadata", {})
+            hosts[(metadata.get("namespace"), metadata.get("name"))] = route.get("spec", {}).get("host", "")
+    facts = dict((fact, hosts.get(route, "")) for fact, route in ROUTE_FACTS.items())
+    masters = [line.split("/")[-1] for line in sections.get("nodes", "").splitlines() if "master" in line]
+    facts["OPENSHIFT_MASTER_HOST"] = "\n".join(masters)
+    facts["OPENSHIFT_MANAGEMENT_ADMIN_TOKEN"] = sections.get("token", "")
+    facts["OPENSHIFT_CA_CRT"] = sections.get("ca_crt", "")
+    return facts
+
+
+def format_shell(facts):
+    return "".join("export {0}={1}\n".format(name, quote(value)) for name, value in sorted(facts.items()))
+
+
+def collect_facts(client):
+    """ Collect the facts over an SSH session to the master, in one round trip """
+    return parse_facts(split_sections(node_prep.run_command(client, batch_script())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect the cluster facts ManageIQ's provider setup needs")
+    parser.add_argument('--host', nargs='?', type=str, required=True, help="The cluster master")
+    parser.add_argument('--root-password-env', nargs='?', type=str,
+                        default=node_prep.DEFAULT_ROOT_PASS_ENV_VAR,
+                        help="Env variable holding the master root password")
+    parser.add_argument('--cache-file', nargs='?', type=str,
+                        help="JSON file the facts are read from if it exists, written to otherwise")
+    parser.add_argument('--refresh', action='store_true', help="Ignore the cached facts")
+    parser.add_argument('--upload-env', nargs='?', type=str,
+                        help="Also write the facts as shell exports to this path on the master (for plugins)")
+    parser.add_argument('--format', nargs='?', choices=["shell", "json"], default="shell")
+    args = parser.parse_args()
+
+    facts = None
+    if args.cache_file and not args.refresh and os.path.exists(args.cache_file):
+        with open(args.cache_file, "r") as f:
+            facts = json.load(f)
+        print("Using the cluster facts cached in {0}".format(args.cache_file), file=sys.stderr)
+
+    if facts is None:
+        if args.root_password_env not in os.environ:
+            raise SystemExit("missing root password env var {0}".format(args.root_password_env))
+        client = node_prep.ssh_connect(args.host, os.environ[args.root_password_env])
+        try:
+            facts = collect_facts(client)
+            if args.upload_env:
+                # like the local cache, only readable by its owner (the
+                # chmod covers a file left by an earlier upload)
+                path = quote(args.upload_env)
+                node_prep.run_command(client, "umask 077 && cat > {0} && chmod 600 {0}".format(path),
+                                      stdin_data=format_shell(facts))
+        finally:
+            client.close()
+        if args.cache_file:
+            # the facts hold the admin token, keep them private
+            fd = os.open(args.cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(facts, f, indent=1, sort_keys=True)
+
+    if args.format == "json":
+        print(json.dumps(facts, indent=1, sort_keys=True))
+    else:
+        sys.stdout.write(format_shell(facts))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,19 +22,109 @@ import os
 import sys
 import argparse
 import logging
+import random
+import re
 import time
+from multiprocessing.pool import ThreadPool
 import ovirtsdk4 as sdk
 import ovirtsdk4.types as types
+import lun_manager
 import ovirt_utils
+import timing
 
 # CONSTANTS
 
 DEFAULT_OVIRT_PUB_SSHKEY_ENV_VAR = "OV_SSH_KEY"
+# Link followed when listing VMs so their reported devices (and IPs)
+# are returned with the same request
+REPORTED_DEVICES_FOLLOW = "reported_devices"
+# Without --timeout, give the VMs as long as the separate create, start
+# and wait-for-ip phases used to get
+DEFAULT_TIMEOUT_PHASES = 3
+
+# Adaptive mode: add() round trips slower than this shrink the window
+ADAPTIVE_TARGET_LATENCY = 10
+# Adaptive mode: shortest sleep between status sweeps, in seconds
+ADAPTIVE_MIN_SLEEP = 1
+# Adaptive mode: how many times in a row a VM's add() or start() is retried before giving up
+ADAPTIVE_CALL_RETRIES = 5
+
+# Events mode: sleep between reads of the events feed, in seconds
+EVENTS_POLL_INTERVAL = 1
+
+# Pool mode: standby VMs are named <tag>-NNNN
+STANDBY_NAME_TEMPLATE = "{tag}-{i:04d}"
+
+# Placement: node types that should not share a host, when the engine can
+# help it (a soft negative affinity group, named after the cluster)
+ANTI_AFFINITY_NODE_TYPES = ("master", "infra")
+ANTI_AFFINITY_GROUP_TEMPLATE = "{name_prefix}-spread"
+# Placement: space planned on a storage domain for every thin clone, in GiB
+DEFAULT_PLACEMENT_DISK_GB = 10
+NODE_TYPE_PATTERN = re.compile("-(master|infra|compute)[0-9]+$")
+
+# VM lifecycle states used by create_vms()
+VM_STATE_PENDING = "pending"
+VM_STATE_CREATED = "created"
+VM_STATE_STARTING = "starting"
+VM_STATE_UP = "up"
+VM_STATE_DONE = "done"
 
 # GLOBALS
 connection = None
 system_service = None
 vms_service = None
+tracer = timing.Tracer()
+
+
+class AimdWindow(object):
+    """ Additive-increase / multiplicative-decrease window of in-flight add() calls """
+
+    def __init__(self, initial, maximum, target_latency=ADAPTIVE_TARGET_LATENCY):
+        self.size = max(1, initial)
+        self.maximum = max(self.size, maximum)
+        self.target_latency = target_latency
+        self.largest = self.size
+        self.errors = 0
+
+    def on_success(self, latency):
+        """ Grow the window by one, unless the engine is getting slow """
+        if latency > self.target_latency:
+            self.size = max(1, self.size // 2)
+        elif self.size < self.maximum:
+            self.size += 1
+            self.largest = max(self.largest, self.size)
+
+    def on_error(self):
+        """ Halve the window """
+        self.errors += 1
+        self.size = max(1, self.size // 2)
+
+
+class EventWatcher(object):
+    """ Reads the engine events feed incrementally, from the last seen event id """
+
+    def __init__(self, events_service):
+        self.events_service = events_service
+        latest = events_service.list(max=1)
+        self.last_id = int(latest[0].id) if latest else 0
+
+    def poll(self):
+        """ Return the ids of the VMs mentioned by the events since the last poll """
+        touched = set()
+        with tracer.call("events"):
+            events = self.events_service.list(from_=self.last_id)
+        for event in events:
+            self.last_id = max(self.last_id, int(event.id))
+            if event.vm is not None and event.vm.id is not None:
+                touched.add(event.vm.id)
+        return touched
+
+
+def backoff_delay(attempt, base, cap):
+    """ Exponential backoff delay with jitter, capped at `cap` seconds """
+    delay = min(cap, base * (2 ** attempt))
+    return delay / 2.0 + random.uniform(0, delay / 2.0)
 
 
 def str2bool(val):
@@ -47,21 +137,31 @@ def str2bool(val):
         raise argparse.ArgumentTypeError('Boolean value expected.')
 
 
-logging.basicConfig(level=logging.DEBUG, filename="cm_ovirt_vm_creator.log")
+def do_work(args):
+    """ runs the operation, and reports where the time went """
+    try:
+        run(args)
+    finally:
+        tracer.print_summary()
+        if args.trace_file:
+            tracer.write_json(args.trace_file)
 
 
-def do_work(args):
-    """ creates the base constructs & configs required to run the operation  """
+def run(args):
+    """ connects to the engine and runs the requested operation """
     global connection
     global system_service
     global vms_service
-    try:
-        connection = sdk.Connection(url=args.ovirt_url,
-                                    username=args.ovirt_user,
-                                    password=os.environ[args.ovirt_pass],
-                                    ca_file=args.ovirt_ca_pem_file,
-                                    debug=True,
-                                    log=logging.getLogger())
+    # one HTTP connection per request we may have in flight
+    max_in_flight = max(args.block_size, args.max_block_size if args.adaptive else 0)
+    connect_started = time.time()
+    with ovirt_utils.ovirt_connection(args.ovirt_url, args.ovirt_user,
+                                      os.environ[args.ovirt_pass], args.ovirt_ca_pem_file,
+                                      token_cache_dir=args.ovirt_token_cache,
+                                      connections=max_in_flight,
+                                      debug=args.wire_log,
+                                      log=logging.getLogger()) as connection:
+        tracer.record(timing.KIND_PHASE, "connect", connect_started)
         system_service = connection.system_service()
         vms_service = system_service.vms_service()
         cluster_nodes = []
@@ -76,22 +176,32 @@ def do_work(args):
             cluster_nodes.append(vm_name_template.format(name_prefix=args.name_prefix,
                                                          node_type="compute", i=idx))
         print(cluster_nodes, file=sys.stderr)
-        if args.info:
-            get_vms_info(cluster_nodes, args)
+        if args.refill_pool is not None:
+            with tracer.phase("refill_pool"):
+                refill_pool(args)
+        elif args.destroy:
+            with tracer.phase("destroy"):
+                destroy_cluster(args)
+        elif args.info:
+            with tracer.phase("get_vms_info"):
+                vm_index = build_vm_index(cluster_nodes, args.name_prefix,
+                                          follow=REPORTED_DEVICES_FOLLOW)
+                get_vms_info(cluster_nodes, vm_index, args)
         else:
-            create_vms(cluster_nodes, args)
-    finally:
-        if connection:
-            connection.close()
+            with tracer.phase("create_vms"):
+                vm_index = build_vm_index(cluster_nodes, args.name_prefix)
+                # a cached cluster list without this cluster could get its
+                # storage cleaned up as stale
+                ovirt_utils.drop_vm_clusters_cache(args.ovirt_url, args.ovirt_token_cache)
+                print_ips(create_vms(cluster_nodes, vm_index, args))
 
 
-def get_vms_info(cluster_nodes, args):
+def get_vms_info(cluster_nodes, vm_index, args):
     """ Gets the ips of all the vms in cluster_nodes list  """
-    vm_dict = {}
-    for node in vm_iterator(cluster_nodes):
-        node_name = node.get().name
-        print(node_name, file=sys.stderr)
-        vm_dict[node_name] = find_vm_ip(node)
+    for node_name in cluster_nodes:
+        if node_name not in vm_index:
+            print("VM %s was not found" % (node_name), file=sys.stderr)
+    vm_dict = find_vm_ips(vm_index)
 
     if len(vm_dict) != len(cluster_nodes):
         print("PROBLEM - not all VMs were detected on the system", file=sys.stderr)
@@ -101,14 +211,22 @@ def get_vms_info(cluster_nodes, args):
 
 
 def find_vm_ip(vm):
-    """ Find the IPv4 address of a given VM """
-    for dev in vm.reported_devices_service().list():
+    """ Find the IPv4 address of a given VM (listed with its reported devices) """
+    for dev in vm.reported_devices or []:
         if dev.name == 'eth0':
-            for ip in dev.ips:
+            for ip in dev.ips or []:
                 if ip.version == types.IpVersion.V4:
                     return ip.address
 
 
+def find_vm_ips(vm_index):
+    """ Find the IPv4 addresses of all the VMs in a name->VM index """
+    ips = {}
+    for node_name, vm in vm_index.items():
+        ips[node_name] = find_vm_ip(vm)
+    return ips
+
+
 def print_ips(vm_dict):
     """ Print IPs for VMs in a bash env var format """
     masters = []
@@ -129,142 +247,561 @@ def print_ips(vm_dict):
     print("#################################################################")
 
 
-def vm_iterator(cluster_nodes):
-    """ Iterates through the nodes in cluster_nodes list and obtains its vm_service object """
-    for node in cluster_nodes:
-        vm = vms_service.list(search=construct_search_by_name_query(node))[0]
-        vm_service = vms_service.vm_service(vm.id)
-        yield vm_service
-
+def construct_search_by_prefix_query(name_prefix):
+    """  Constructs the vm query string matching all the VMs with a given name prefix  """
+    search_string = "name={name_prefix}-*"
+    return search_string.format(name_prefix=name_prefix).__str__()
+
+
+def build_vm_index(cluster_nodes, name_prefix, follow=None):
+    """ Fetch all the cluster VMs with a single query and index them by name """
+    wanted = set(cluster_nodes)
+    vm_index = {}
+    list_args = {"search": construct_search_by_prefix_query(name_prefix)}
+    if follow is not None:
+        list_args["follow"] = follow
+    with tracer.call("list" if follow is None else "list+" + follow):
+        vms = vms_service.list(**list_args)
+    for vm in vms:
+        # the prefix query can also match VMs of clusters sharing our prefix
+        # (e.g. "ocp-*" matches "ocp-foo-master001"), keep only our nodes
+        if vm.name in wanted:
+            vm_index[vm.name] = vm
+    return vm_index
+
+
+def read_placement_inventory(args):
+    """ Read what placement needs from the engine, once
+
+    Returns the cluster, the available bytes of every active data domain
+    of its data center, and the disks of the template as (disk id, ids of
+    the domains holding it) pairs: thin clones can only live where the
+    template disk is.
+    """
+    cluster = find_cluster(args.ovirt_cluster)
+    data_center_service = system_service.data_centers_service().data_center_service(cluster.data_center.id)
+    with tracer.call("list storage domains"):
+        domains = data_center_service.storage_domains_service().list()
+    with tracer.call("list templates"):
+        templates_service = system_service.templates_service()
+        template = templates_service.list(search="name={0}".format(args.ovirt_template))[0]
+    with tracer.call("list template disks"):
+        attachments = templates_service.template_service(template.id).disk_attachments_service().list(follow="disk")
+
+    available = dict((domain.id, domain.available or 0) for domain in domains
+                     if domain.type == types.StorageDomainType.DATA and
+                     domain.status == types.StorageDomainStatus.ACTIVE)
+    template_disks = [(attachment.disk.id, set(domain.id for domain in attachment.disk.storage_domains or []))
+                      for attachment in attachments]
+    return cluster, available, template_disks
+
+
+def node_type(node):
+    match = NODE_TYPE_PATTERN.search(node)
+    return match.group(1) if match else None
+
+
+def plan_placement(nodes, available, template_disks, disk_bytes):
+    """ Spread the nodes over storage domains and hosts, return {node: (anti-affinity, {disk id: domain id})}
+
+    Every disk goes to the domain holding the template disk that has the
+    most space left once the disks already planned are accounted for, an
+    exception is raised when even that one is short of disk_bytes.
+    Masters & infra nodes go in the anti-affinity group, so the engine
+    starts them on separate hosts when it can (and anywhere when it can't),
+    compute nodes are left to the engine.
+    """
+    planned_bytes = dict((domain_id, 0) for domain_id in available)
+    plan = {}
+    for node in nodes:
+        disks = {}
+        for disk_id, domain_ids in template_disks:
+            candidates = [domain_id for domain_id in domain_ids if domain_id in available]
+            if not candidates:
+                raise Exception("No active data domain holds disk {0} of the template".format(disk_id))
+            domain_id = max(candidates, key=lambda d: available[d] - planned_bytes[d])
+            if available[domain_id] - planned_bytes[domain_id] < disk_bytes:
+                raise Exception("No data domain holding disk {0} of the template has room for {1} "
+                                "more disks".format(disk_id, len(nodes) - len(plan)))
+            planned_bytes[domain_id] += disk_bytes
+            disks[disk_id] = domain_id
+        plan[node] = (node_type(node) in ANTI_AFFINITY_NODE_TYPES, disks)
+    return plan
+
+
+def find_cluster(name):
+    with tracer.call("list clusters"):
+        return system_service.clusters_service().list(search="name={0}".format(name))[0]
+
+
+def find_affinity_group(cluster, name):
+    """ Return the service of a cluster's affinity group, None if it doesn't exist """
+    groups_service = system_service.clusters_service().cluster_service(cluster.id).affinity_groups_service()
+    with tracer.call("list affinity groups"):
+        groups = groups_service.list()
+    for group in groups:
+        if group.name == name:
+            return groups_service.group_service(group.id)
+    return None
+
+
+def ensure_anti_affinity_group(cluster, name_prefix):
+    """ Return the service of the (soft) anti-affinity group of a cluster, creating it if needed """
+    name = ANTI_AFFINITY_GROUP_TEMPLATE.format(name_prefix=name_prefix)
+    group_service = find_affinity_group(cluster, name)
+    if group_service is None:
+        groups_service = system_service.clusters_service().cluster_service(cluster.id).affinity_groups_service()
+        with tracer.call("add affinity group"):
+            group = groups_service.add(types.AffinityGroup(name=name, positive=False, enforcing=False))
+        group_service = groups_service.group_service(group.id)
+    return group_service
+
+
+def add_to_affinity_group(group_service, node, vm_id):
+    """ Add a new VM to the anti-affinity group, a failure only costs the spreading """
+    try:
+        with tracer.call("add to affinity group"):
+            group_service.vms_service().add(types.Vm(id=vm_id))
+    except sdk.Error as e:
+        print("WARNING - %s could not join the anti-affinity group: %s" % (node, e), file=sys.stderr)
+
+
+def build_vm_spec(node, args, placement=None):
+    """ The VM to add() for a node, placed according to the placement plan if any """
+    vm = types.Vm(name=node,
+                  cluster=types.Cluster(name=args.ovirt_cluster),
+                  template=types.Template(name=args.ovirt_template))
+    if placement is not None and node in placement:
+        _, disks = placement[node]
+        # thin (COW) disks on top of the template disk, on the planned domains
+        vm.disk_attachments = [types.DiskAttachment(disk=types.Disk(id=disk_id,
+                                                                    format=types.DiskFormat.COW,
+                                                                    sparse=True,
+                                                                    storage_domains=[types.StorageDomain(id=domain_id)]))
+                               for disk_id, domain_id in disks.items()]
+    return vm
+
+
+def find_tag(name):
+    """ Return the id of a tag, None if it doesn't exist """
+    with tracer.call("list tags"):
+        tags = system_service.tags_service().list()
+    for tag in tags:
+        if tag.name == name:
+            return tag.id
+    return None
+
+
+def find_standby_vms(tag):
+    """ List the standby VMs carrying a tag, the running ones first """
+    with tracer.call("list standby"):
+        vms = vms_service.list(search="tag={0}".format(tag))
+    return sorted(vms, key=lambda vm: (vm.status != types.VmStatus.UP, vm.name))
+
+
+def claim_standby_vms(nodes, tag, window_size):
+    """ Claim standby VMs for the nodes, return {node: vm} (short when the pool is)
+
+    A VM is claimed by removing the tag from it, which only one build can
+    do, and is then renamed to the node it stands for. A VM that can't be
+    renamed is tagged again, and its node is left to the template.
+    """
+    tag_id = find_tag(tag)
+    if tag_id is None:
+        return {}
+    candidates = find_standby_vms(tag)
+    claimed = []
+    while candidates and len(claimed) < len(nodes):
+        batch = candidates[:len(nodes) - len(claimed)]
+        candidates = candidates[len(batch):]
+        # an untag failing means another build claimed that VM first
+        untagged, _ = call_in_window([(vm.name, lambda vm=vm: vms_service.vm_service(vm.id).tags_service()
+                                       .tag_service(tag_id).remove()) for vm in batch], window_size, "untag")
+        claimed.extend(vm for vm in batch if vm.name in untagged)
+
+    standby = dict(zip(nodes, claimed))
+    for node, vm in sorted(standby.items()):
+        print("%s: claiming standby VM %s" % (node, vm.name), file=sys.stderr)
+    renamed, failed = call_in_window([(node, lambda node=node, vm=vm: vms_service.vm_service(vm.id)
+                                       .update(types.Vm(name=node))) for node, vm in standby.items()],
+                                     window_size, "rename")
+    _, lost = call_in_window([(standby[node].name, lambda vm=standby[node]: vms_service.vm_service(vm.id)
+                               .tags_service().add(types.Tag(name=tag))) for node in failed],
+                             window_size, "tag")
+    for name in lost:
+        print("ERROR - standby VM %s is out of the %s pool, remove it by hand" % (name, tag), file=sys.stderr)
+    return renamed
+
+
+def refill_pool(args):
+    """ Create, start and tag standby VMs until the pool has args.refill_pool of them """
+    tag = args.from_pool
+    if find_tag(tag) is None:
+        with tracer.call("add tag"):
+            system_service.tags_service().add(types.Tag(name=tag))
+    missing = args.refill_pool - len(find_standby_vms(tag))
+    if missing <= 0:
+        print("The %s pool is full" % (tag), file=sys.stderr)
+        return
+
+    # standby VMs that were claimed got renamed, their names are free again
+    with tracer.call("list"):
+        taken = set(vm.name for vm in vms_service.list(search=construct_search_by_prefix_query(tag)))
+    standby_nodes = []
+    i = 1
+    while len(standby_nodes) < missing:
+        name = STANDBY_NAME_TEMPLATE.format(tag=tag, i=i)
+        if name not in taken:
+            standby_nodes.append(name)
+        i += 1
+
+    # the standby VMs are booted (with the cloud-init key) just like cluster nodes,
+    # and only become claimable once they're up with an IP
+    # (their IPs are not printed, they're nobody's nodes yet)
+    pool_args = argparse.Namespace(**dict(vars(args), name_prefix=tag, from_pool=None))
+    create_vms(standby_nodes, {}, pool_args)
+    vm_index = build_vm_index(standby_nodes, tag)
+    tagged, _ = call_in_window([(name, lambda vm=vm: vms_service.vm_service(vm.id).tags_service()
+                                 .add(types.Tag(name=tag))) for name, vm in vm_index.items()],
+                               args.block_size, "tag")
+    print("Added %d VMs to the %s pool" % (len(tagged), tag), file=sys.stderr)
+
+
+def find_cluster_vms(name_prefix):
+    """ Fetch all the VMs of a cluster, whatever their number, with a single query """
+    with tracer.call("list"):
+        vms = vms_service.list(search=construct_search_by_prefix_query(name_prefix))
+    # the prefix query also matches the VMs of clusters sharing our prefix
+    return [vm for vm in vms if ovirt_utils.match_vm_cluster(vm.name) == name_prefix]
+
+
+def call_in_window(calls, window_size, call_name):
+    """ Run (name, call) pairs, where `call` sends a request and waits for its answer
+
+    The remove() methods of the SDK don't hand their future back with
+    wait=False, so the calls run on a pool of window_size threads sharing
+    the connection instead. Returns ({name: result} of the calls that
+    succeeded, [names of the calls that failed]).
+    """
+    def run_call(item):
+        name, call = item
+        sent_at = time.time()
+        try:
+            result = call()
+        except sdk.Error as e:
+            tracer.record(timing.KIND_CALL, call_name + " (failed)", sent_at)
+            print("%s: %s failed: %s" % (name, call_name, e), file=sys.stderr)
+            return name, False, None
+        tracer.record(timing.KIND_CALL, call_name, sent_at)
+        return name, True, result
+
+    if not calls:
+        return {}, []
+    pool = ThreadPool(max(1, min(window_size, len(calls))))
+    try:
+        outcomes = pool.map(run_call, calls)
+    finally:
+        pool.close()
+        pool.join()
+    return (dict((name, result) for name, ok, result in outcomes if ok),
+            [name for name, ok, _ in outcomes if not ok])
+
+
+def destroy_vms(name_prefix, args):
+    """ Stop and remove all the VMs of a cluster, return the names of the VMs that couldn't be removed """
+    vms = find_cluster_vms(name_prefix)
+    print("Found %d VMs of cluster %s" % (len(vms), name_prefix), file=sys.stderr)
+    if not vms:
+        return []
+
+    timeout = args.timeout
+    if timeout is None:
+        timeout = args.num_of_iterations * args.sleep_between_iterations
+    deadline = time.time() + timeout
+    stopped = set()
+    while True:
+        # every sweep removes the VMs that are down, and stops the others
+        # again if their stop failed (a failed remove is retried the same way)
+        to_stop = [vm for vm in vms if vm.status != types.VmStatus.DOWN and vm.name not in stopped]
+        _, failed = call_in_window([(vm.name, lambda vm=vm: vms_service.vm_service(vm.id).stop())
+                                    for vm in to_stop], args.block_size, "stop")
+        stopped.update(vm.name for vm in to_stop if vm.name not in failed)
+        removed, _ = call_in_window([(vm.name, lambda vm=vm: vms_service.vm_service(vm.id).remove())
+                                     for vm in vms if vm.status == types.VmStatus.DOWN], args.block_size, "remove")
+        left = [vm.name for vm in vms if vm.name not in removed]
+        if not left:
+            return []
+        if time.time() >= deadline:
+            print("ERROR - VMs %s still not removed after %s seconds" % (" ".join(left), timeout), file=sys.stderr)
+            return left
+        print("waiting for %d VMs to go down and be removed" % len(left), file=sys.stderr)
+        time.sleep(args.sleep_between_iterations)
+        vms = find_cluster_vms(name_prefix)
+
+
+def reclaim_cluster_storage(name_prefix, args):
+    """ Delete the LUN and the NFS exports of a cluster, return the number of failures """
+    failed = 0
+    if args.reclaim_lun:
+        lun_name = "cm-{0}".format(name_prefix)
+        backend = lun_manager.connect_backend(args.netapp_backend, args.netapp_server, args.netapp_username,
+                                              args.netapp_vserver,
+                                              password=os.environ.get(args.netapp_password_env))
+        try:
+            with tracer.phase("reclaim lun"):
+                to_delete = [lun for lun in backend.get_luns() if lun['name'] == lun_name]
+                if to_delete:
+                    failed += lun_manager.print_cleanup_report(lun_manager.run_cleanup_plan(backend, to_delete))
+                else:
+                    print("No lun {0} to delete".format(lun_name), file=sys.stderr)
+        finally:
+            backend.close()
+    if args.reclaim_nfs_root:
+        # only needed (and imported) when reclaiming the NFS exports
+        import nfs_reclaim
+        path = os.path.join(args.reclaim_nfs_root, name_prefix)
+        if os.path.isdir(path):
+            with tracer.phase("reclaim nfs"):
+                report = nfs_reclaim.run_reclaim_plan([{"name": name_prefix, "path": path, "size": None}])
+                failed += nfs_reclaim.print_reclaim_report(report)
+        else:
+            print("No exports to delete at {0}".format(path), file=sys.stderr)
+    return failed
+
+
+def destroy_cluster(args):
+    """ Remove the VMs of the cluster, and optionally its storage """
+    not_removed = destroy_vms(args.name_prefix, args)
+    # the cached cluster list still has this cluster
+    ovirt_utils.drop_vm_clusters_cache(args.ovirt_url, args.ovirt_token_cache)
+    if not_removed:
+        print("ERROR - could not remove VMs %s, keeping the cluster storage" % " ".join(not_removed),
+              file=sys.stderr)
+        sys.exit(-1)
+    if args.placement:
+        group_service = find_affinity_group(find_cluster(args.ovirt_cluster),
+                                            ANTI_AFFINITY_GROUP_TEMPLATE.format(name_prefix=args.name_prefix))
+        if group_service is not None:
+            with tracer.call("remove affinity group"):
+                group_service.remove()
+    if reclaim_cluster_storage(args.name_prefix, args):
+        sys.exit(-1)
 
-def construct_search_by_name_query(node_name):
-    """  Constructs the vm query string buy name  """
-    search_string = "name={node_name}"
-    return search_string.format(node_name=node_name).__str__()
 
+def set_vm_state(states, state_since, node, state):
+    """ Move a VM to a new lifecycle state, recording the time spent in the old one """
+    tracer.record(timing.KIND_PHASE, "vm " + states[node], state_since[node])
+    states[node] = state
+    state_since[node] = time.time()
 
-def chunks(l, n):
-    """Yield successive n-sized chunks from l."""
-    for i in range(0, len(l), n):
-        yield l[i:i + n]
 
+def create_vms(cluster_nodes, vm_index, args):
+    """ creates the vms in cluster_nodes list, and skipps if they exist, returns {node: ip}
 
-def create_vms(cluster_nodes, args):
-    """ creates the vms in cluster_nodes list, and skipps if they exist """
-    vm_dict = {}
-    to_create = []
+    Every VM goes through its own create -> start -> up -> ip lifecycle:
+    on each iteration the status (and reported IPs) of all the VMs is
+    fetched with a single query, every VM is advanced as far as it can go,
+    and new add() calls are sent while the window allows. A VM is started
+    as soon as it's created and its IP is looked up as soon as it's up,
+    without waiting for the rest of the cluster.
+    """
+    states = {}
+    state_since = {}
+    vm_services = {}
+    vm_ids = {}
+    pending = []
 
     # Figure out which nodes we need to create, and which are already running
     for node in cluster_nodes:
         print("node=%s" % (node), file=sys.stderr)
-        tmp = vms_service.list(search=construct_search_by_name_query(node))
-        if len(tmp) == 1:
-            vm_dict[node] = vms_service.vm_service(tmp[0].id)
+        if node in vm_index:
+            vm_services[node] = vms_service.vm_service(vm_index[node].id)
+            vm_ids[vm_index[node].id] = node
+            states[node] = VM_STATE_CREATED
             print("VM %s was found ... skipping creation" % (node), file=sys.stderr)
         else:
-            to_create.append(node)
-
-    # Create the VM in "blocks"
-    for block in chunks(to_create, args.block_size):
-        block_futures = []
-        for node in block:
-            vm_future = vms_service.add(types.Vm(name=node,
-                                                 cluster=types.Cluster(name=args.ovirt_cluster),
-                                                 template=types.Template(name=args.ovirt_template)), wait=False)
-            block_futures.append((node, vm_future))
-        # wait for all the VMs from this block to be created
-        for node_name, future_vm in block_futures:
-            vm = future_vm.wait()
-            vm_dict[node_name] = vms_service.vm_service(vm.id)
-        # sleep before the next block
-        time.sleep(args.sleep_between_iterations)
+            states[node] = VM_STATE_PENDING
+            pending.append(node)
+
+    if args.from_pool and pending:
+        # Standby VMs are already up, only the nodes the pool can't cover
+        # are created from the template
+        claimed = claim_standby_vms(pending, args.from_pool, args.block_size)
+        for node, vm in claimed.items():
+            vm_services[node] = vms_service.vm_service(vm.id)
+            vm_ids[vm.id] = node
+            states[node] = VM_STATE_CREATED
+            pending.remove(node)
+        print("%d VMs claimed from the %s pool, %d to create" % (len(claimed), args.from_pool, len(pending)),
+              file=sys.stderr)
+
+    placement = None
+    group_service = None
+    if args.placement and pending:
+        with tracer.phase("placement"):
+            cluster, available, template_disks = read_placement_inventory(args)
+            placement = plan_placement(pending, available, template_disks,
+                                       args.placement_disk_gb * 1024 ** 3)
+            if any(spread for spread, _ in placement.values()):
+                group_service = ensure_anti_affinity_group(cluster, args.name_prefix)
+        for node in pending:
+            spread, disks = placement[node]
+            print("%s: disks %s%s" % (node, disks, ", anti-affinity" if spread else ""), file=sys.stderr)
+
+    window = None
+    call_retries = {}
+    if args.adaptive:
+        window = AimdWindow(args.block_size, args.max_block_size)
+    idle_iterations = 0
+
+    watcher = None
+    if args.use_events:
+        watcher = EventWatcher(system_service.events_service())
+    touched = set()
+    last_sweep = 0
 
-    # Start each VM when it's created, but try to batch the calls
-    counter = 1
-    starting = set()
     pub_sshkey = os.environ[args.pub_sshkey]
-    # number of attempts is bigger here because it's not attempts per VM
-    # like in the other nodes.
-    while counter < args.num_of_iterations * len(cluster_nodes):
-        start_futures = []
-        for node_name, vm_service in vm_dict.items():
-            if node_name in starting:
+    timeout = args.timeout
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT_PHASES * args.num_of_iterations * args.sleep_between_iterations
+    deadline = time.time() + timeout
+    for node in cluster_nodes:
+        state_since[node] = time.time()
+    ips_dict = {}
+    while True:
+        if watcher is not None and not pending and time.time() < deadline:
+            # Only sweep when the events feed mentioned one of our VMs, or
+            # when there was no sweep for a while: every sleep-between-iterations
+            # while VMs wait for their IP (there are no events for those), and
+            # every events-fallback when the feed is quiet.
+            touched |= watcher.poll() & set(vm_ids)
+            waiting_for_ip = any(state == VM_STATE_UP for state in states.values())
+            sweep_interval = args.sleep_between_iterations if waiting_for_ip else args.events_fallback
+            if not touched and time.time() - last_sweep < sweep_interval:
+                time.sleep(EVENTS_POLL_INTERVAL)
                 continue
-            vm = vm_service.get()
-            print("%s: vm.status = %s" % (node_name, vm.status), file=sys.stderr)
-            if vm.status == types.VmStatus.DOWN:
-                print("%s: starting" % (node_name), file=sys.stderr)
-                future = vm_service.start(use_cloud_init=True, wait=False,
-                                          vm=types.Vm(initialization=types.Initialization(authorized_ssh_keys=pub_sshkey)))
-                start_futures.append(future)
-                starting.add(node_name)
-            elif vm.status == types.VmStatus.UP:
-                # make sure we don't wait forever for VMs to be down when they're
-                # already up.
-                starting.add(node_name)
-
-        # wait for this batch of VMs
-        print("batch size = %s" % len(start_futures))
-        for future in start_futures:
-            future.wait()
-
-        if len(starting) == len(cluster_nodes):
-            # We called .start() on all VMs
+        touched = set()
+        last_sweep = time.time()
+
+        # Advance the VMs that already exist using a single status sweep,
+        # the reported devices are only followed once there are VMs that
+        # may have an IP.
+        follow = None
+        if any(state in (VM_STATE_STARTING, VM_STATE_UP) for state in states.values()):
+            follow = REPORTED_DEVICES_FOLLOW
+        status_table = build_vm_index(cluster_nodes, args.name_prefix, follow=follow)
+
+        in_flight = []
+        progress = False
+        for node in cluster_nodes:
+            state = states[node]
+            vm = status_table.get(node)
+            if state in (VM_STATE_PENDING, VM_STATE_DONE) or vm is None:
+                continue
+            if state == VM_STATE_CREATED:
+                if vm.status == types.VmStatus.DOWN:
+                    print("%s: starting" % (node), file=sys.stderr)
+                    future = vm_services[node].start(use_cloud_init=True, wait=False,
+                                                     vm=types.Vm(initialization=types.Initialization(authorized_ssh_keys=pub_sshkey)))
+                    in_flight.append((node, VM_STATE_STARTING, future, time.time()))
+                    continue
+                elif vm.status == types.VmStatus.UP:
+                    # make sure we don't wait forever for VMs to be down when they're
+                    # already up.
+                    state = VM_STATE_UP
+            elif state == VM_STATE_STARTING and vm.status == types.VmStatus.UP:
+                state = VM_STATE_UP
+            if state == VM_STATE_UP and follow is not None:
+                ip = find_vm_ip(vm)
+                if ip is not None:
+                    ips_dict[node] = ip
+                    state = VM_STATE_DONE
+            if state != states[node]:
+                print("%s: %s -> %s (vm.status = %s)" % (node, states[node], state, vm.status), file=sys.stderr)
+                set_vm_state(states, state_since, node, state)
+                progress = True
+
+        # Send new add() calls while the window allows it
+        window_size = window.size if window else args.block_size
+        while pending and len(in_flight) < window_size:
+            node = pending.pop(0)
+            print("%s: creating" % (node), file=sys.stderr)
+            future = vms_service.add(build_vm_spec(node, args, placement), wait=False)
+            in_flight.append((node, VM_STATE_CREATED, future, time.time()))
+
+        # The requests are sent concurrently, wait for all of them, the add()
+        # calls first so each one is timed on its own, without the starts
+        print("requests in flight = %s" % len(in_flight), file=sys.stderr)
+        call_failed = False
+        add_latencies = []
+        for node, next_state, future, sent_at in sorted(in_flight, key=lambda item: item[1] != VM_STATE_CREATED):
+            call_name = "add" if next_state == VM_STATE_CREATED else "start"
+            try:
+                result = future.wait()
+                tracer.record(timing.KIND_CALL, call_name, sent_at)
+            except sdk.Error as e:
+                tracer.record(timing.KIND_CALL, call_name + " (failed)", sent_at)
+                if window is None:
+                    raise
+                # let the engine breathe and retry this VM later
+                retry_key = (node, call_name)
+                call_retries[retry_key] = call_retries.get(retry_key, 0) + 1
+                if call_retries[retry_key] > ADAPTIVE_CALL_RETRIES:
+                    raise
+                print("%s: %s failed, will retry: %s" % (node, call_name, e), file=sys.stderr)
+                if next_state == VM_STATE_CREATED:
+                    pending.insert(0, node)
+                # a VM that failed to start is still created, the next sweep
+                # starts it again (or finds it up)
+                call_failed = True
+                continue
+            call_retries.pop((node, call_name), None)
+            if next_state == VM_STATE_CREATED:
+                add_latencies.append(time.time() - sent_at)
+                vm_services[node] = vms_service.vm_service(result.id)
+                vm_ids[result.id] = node
+                if placement is not None and placement[node][0]:
+                    # before the VM is started, so the engine places it accordingly
+                    add_to_affinity_group(group_service, node, result.id)
+            set_vm_state(states, state_since, node, next_state)
+            progress = True
+
+        if window is not None:
+            if call_failed:
+                window.on_error()
+            elif add_latencies:
+                window.on_success(max(add_latencies))
+
+        if all(state == VM_STATE_DONE for state in states.values()):
             break
 
-        time.sleep(args.sleep_between_iterations)
-        counter += 1
-    else:
-        # else clause on while will run when while is finished without "break".
-        # This means not all VMs were created, and that's an error
-        not_started = set(cluster_nodes) - set(starting)
-        total_time_waited = args.num_of_iterations * args.sleep_between_iterations
-        print("ERROR - VMs {0} still not created after {1} seconds".format(not_started, total_time_waited), file=sys.stderr)
-        sys.exit(-1)
-
-    # Wait for all the VMs to be up before we wait for IPs,
-    # this serves two functions:
-    # 1) a more useful error message if the VM takes too long to start
-    # 2) effectively a more graceful timeout waiting for IPs
-    for node, vm_service in vm_dict.items():
-        counter = 1
-        while counter < args.num_of_iterations:
-            vm = vm_service.get()
-            print("%s: vm.status = %s, vm.fqdn= '%s'" % (node, vm.status, vm.fqdn), file=sys.stderr)
-            if vm.status == types.VmStatus.UP:
-                break
-            counter += 1
-            time.sleep(args.sleep_between_iterations)
-
-        if vm.status != types.VmStatus.UP:
-            print("ERROR - VM {0} still not up after {1} retries".format(node, args.num_of_iterations), file=sys.stderr)
+        if time.time() >= deadline:
+            for node in cluster_nodes:
+                if states[node] != VM_STATE_DONE:
+                    print("ERROR - VM {0} is still {1} after {2} seconds".format(node, states[node], timeout), file=sys.stderr)
             sys.exit(-1)
 
-    ips_dict = {}
-    for node, vm_service in vm_dict.items():
-        ip = None
-        counter = 1
-        while counter < args.num_of_iterations:
-            ip = find_vm_ip(vm_service)
-            if ip is not None:
-                break
-            counter += 1
-            msg = "{0} waiting for ip... {1}/{2} attempts".format(node,
-                                                                  counter,
-                                                                  args.num_of_iterations)
-            print(msg, file=sys.stderr)
+        if watcher is not None:
+            # the events feed is read at the top of the loop, give it time to fill up
+            if not pending:
+                time.sleep(EVENTS_POLL_INTERVAL)
+        elif window is not None:
+            # back off while nothing changes, sweep quickly again once it does
+            idle_iterations = 0 if progress and not call_failed else idle_iterations + 1
+            if not pending or call_failed:
+                time.sleep(backoff_delay(idle_iterations, ADAPTIVE_MIN_SLEEP, args.sleep_between_iterations))
+        elif not pending:
+            # nothing left to create, give the engine time before the next sweep
             time.sleep(args.sleep_between_iterations)
 
-        if ip is None:
-            print("ERROR - Node {0} still has no IP after {1} retries".format(node, args.num_of_iterations), file=sys.stderr)
-            sys.exit(-1)
-        ips_dict[node] = ip
-
-    print_ips(ips_dict)
+    if window is not None:
+        summary = "adaptive window: final = {0}, largest = {1}, errors = {2}"
+        print(summary.format(window.size, window.largest, window.errors), file=sys.stderr)
+    return ips_dict
 
 
-def main():
-    # Parse command line arguments
+def build_parser():
+    """ Build the command line parser """
     parser_description = 'Creates a set of VMs to be used by cm-jenkins as  openshift nodes'
     parser = argparse.ArgumentParser(description=parser_description)
     # Mandatory Parameters
@@ -292,11 +829,77 @@ def main():
     parser.add_argument('--num-of-iterations', const=30, nargs='?', type=int, default=20,
                         help='Number of iterations to wait for long VM operations (create & run)')
     parser.add_argument('--block-size', const=10, nargs='?', type=int, default=10,
-                        help='Number of VMs to create in each "block"')
+                        help='Maximal number of create/start requests in flight at the same time')
     parser.add_argument('--sleep-between-iterations', const=5, nargs='?', type=int, default=5,
                         help='sleep time between iterations iterations')
+    parser.add_argument('--adaptive', const=True, nargs='?', type=str2bool, default=False,
+                        help='Adapt the number of requests in flight to the engine response times, '
+                             'starting from --block-size, and retry failed create/start requests')
+    parser.add_argument('--max-block-size', const=50, nargs='?', type=int, default=50,
+                        help='Upper limit of the requests in flight in adaptive mode')
+    parser.add_argument('--use-events', const=True, nargs='?', type=str2bool, default=False,
+                        help='Follow the engine events feed, and only query the VMs status '
+                             'when one of them changes')
+    parser.add_argument('--events-fallback', const=60, nargs='?', type=int, default=60,
+                        help='In events mode, query the VMs status anyway after this many '
+                             'seconds without relevant events')
+    parser.add_argument('--wire-log', const=True, nargs='?', type=str2bool, default=False,
+                        help='Log the full HTTP traffic with the engine to cm_ovirt_vm_creator.log')
+    parser.add_argument('--trace-file', nargs='?', type=str, default=None,
+                        help='Write the timing of every engine call and phase to this JSON file')
+    parser.add_argument('--timeout', nargs='?', type=int, default=None,
+                        help='Overall time to wait for all the VMs to be up with an IP '
+                             '(default: 3 * num-of-iterations * sleep-between-iterations)')
+
+    parser.add_argument('--from-pool', nargs='?', type=str, default=None,
+                        help='Claim the nodes from the standby VMs carrying this tag, and only '
+                             'create the ones the pool is short of from the template')
+    parser.add_argument('--refill-pool', nargs='?', type=int, default=None,
+                        help='Instead of creating a cluster, top the --from-pool standby VMs up '
+                             'to this number')
+
+    # placement
+    parser.add_argument('--placement', const=True, nargs='?', type=str2bool, default=False,
+                        help='Spread the VM disks over the data domains with the most free space, '
+                             'and the masters and infra nodes over separate hosts when possible '
+                             '(with --destroy, remove the anti-affinity group of the cluster)')
+    parser.add_argument('--placement-disk-gb', nargs='?', type=int, default=DEFAULT_PLACEMENT_DISK_GB,
+                        help='Space planned on a storage domain for every disk of a new VM')
+
+    # destroy mode
+    parser.add_argument('--destroy', const=True, nargs='?', type=str2bool, default=False,
+                        help='Stop and remove all the VMs of the cluster, --block-size at a time')
+    parser.add_argument('--reclaim-nfs-root', nargs='?', type=str, default=None,
+                        help='With --destroy, also delete the cluster exports under this (mounted) directory')
+    parser.add_argument('--reclaim-lun', const=True, nargs='?', type=str2bool, default=False,
+                        help='With --destroy, also delete the cluster LUN (cm-<name prefix>)')
+    parser.add_argument('--netapp-server', nargs='?', type=str)
+    parser.add_argument('--netapp-username', nargs='?', type=str)
+    parser.add_argument('--netapp-vserver', nargs='?', type=str)
+    parser.add_argument('--netapp-backend', nargs='?', choices=["ssh", "rest"], default="ssh")
+    parser.add_argument('--netapp-password-env', nargs='?', type=str, default=lun_manager.DEFAULT_NETAPP_PASS_ENV_VAR,
+                        help='Env variable holding the NetApp password, for the rest backend')
+
+    return parser
 
-    args = parser.parse_args()
+
+def main():
+    # Parse command line arguments
+    args = build_parser().parse_args()
+
+    if args.wire_log:
+        # Every request and response body goes to the log file
+        logging.basicConfig(level=logging.DEBUG, filename="cm_ovirt_vm_creator.log")
+    else:
+        logging.basicConfig(level=logging.INFO, filename="cm_ovirt_vm_creator.log")
+
+    if args.refill_pool is not None and not args.from_pool:
+        print("--refill-pool requires --from-pool", file=sys.stderr)
+        sys.exit(-1)
+
+    if args.reclaim_lun and not (args.netapp_server and args.netapp_username and args.netapp_vserver):
+        print("--reclaim-lun requires --netapp-server, --netapp-username and --netapp-vserver", file=sys.stderr)
+        sys.exit(-1)
 
     if not args.name_prefix.strip():
         print("Prefix can't be empty", file=sys.stderr)
@@ -20,8 +20,12 @@
 from __future__ import print_function, unicode_literals
 import ipaddress
 import argparse
+import io
+import json
+import string
 import sys
 import os.path
+from contextlib import closing
 
 # These are compoments that a user can disable or enable
 OPTIONAL_COMPONENTS = ['logging', 'loggingops', 'metrics', 'prometheus', 'manageiq']
@@ -35,8 +39,17 @@ ALL_COMPONENTS = MANDATORY_COMPONENTS + OPTIONAL_COMPONENTS
 DEFAULT_IMAGE_VERSION = 'v3.7'
 DEFAULT_WILDCARD_DNS = 'nip.io'
 
+STORAGE_TYPES = ['external_nfs', 'internal_nfs']
+
 PATH = os.path.dirname(os.path.abspath(__file__))
 BLOCKS_PATH = os.path.join(PATH, "inventory_blocks")
+TEMPLATE_PATH = os.path.join(PATH, "inventory-template.ini")
+
+# Template fields holding the node lists, streamed instead of formatted
+NODE_SPEC_FIELDS = ['infra_spec', 'compute_spec']
+
+# TemplateSet shared by all the inventories rendered by this process
+_templates = None
 
 
 def str2bool(s):
@@ -81,50 +94,94 @@ def format_host(node_type, name_prefix, index, ip, wildcard_dns):
     return host
 
 
-def build_spec(node_type, ips, name_prefix, wildcard_dns):
-    """ Build spec for compute/infra nodes """
-    spec_list = ""
+def iter_spec(node_type, ips, name_prefix, wildcard_dns):
+    """ Yield the spec lines of compute/infra nodes """
     if node_type == "infra":
         node_labels = "{'region': 'infra', 'zone': 'default'}"
     else:
         node_labels = "{'region': 'primary', 'zone': 'default'}"
+    spec = "{host} openshift_hostname={host} openshift_node_labels=\"" + node_labels + "\"\n"
 
     for i, ip in enumerate(ips, 1):
         host = format_host(node_type, name_prefix, i, ip, wildcard_dns)
-        spec = "{host} openshift_hostname={host} openshift_node_labels=\"{node_labels}\"\n"
-        spec = spec.format(node_labels=node_labels, host=host)
-        spec_list += spec
-    return spec_list
+        yield spec.replace("{host}", host)
 
 
-def format_block(component, storage_type, format_args):
+def build_spec(node_type, ips, name_prefix, wildcard_dns):
+    """ Build spec for compute/infra nodes """
+    return "".join(iter_spec(node_type, ips, name_prefix, wildcard_dns))
+
+
+def templates_mtime(blocks_path=BLOCKS_PATH, template_path=TEMPLATE_PATH):
+    """ Latest modification time of the template, the blocks, and the blocks directory """
+    paths = [template_path, blocks_path] + [os.path.join(blocks_path, file_name)
+                                            for file_name in os.listdir(blocks_path)]
+    return max(os.stat(path).st_mtime for path in paths)
+
+
+class TemplateSet(object):
+    """ The inventory template and the component blocks, read from disk once
+
+    The component & storage type blocks are resolved (including the
+    DEFAULT fallbacks) when the set is loaded, so rendering an inventory
+    doesn't touch the disk.
+    """
+
+    def __init__(self, blocks_path=BLOCKS_PATH, template_path=TEMPLATE_PATH):
+        self.blocks_path = blocks_path
+        self.template_path = template_path
+        # taken first, so files edited while loading show up as changed
+        self.mtime = templates_mtime(blocks_path, template_path)
+        blocks = {}
+        for file_name in os.listdir(blocks_path):
+            if file_name.endswith(".ini"):
+                with io.open(os.path.join(blocks_path, file_name), 'r', encoding='utf-8') as f:
+                    blocks[file_name[:-len(".ini")]] = f.read()
+
+        # read as text, so the sections can be written to text streams on python2 too
+        with io.open(template_path, 'r', encoding='utf-8') as f:
+            self.template = f.read()
+        # (literal text, field name, format spec) sections of the template
+        self.sections = [(literal, field_name, format_spec)
+                         for literal, field_name, format_spec, _
+                         in string.Formatter().parse(self.template)]
+
+        self.component_blocks = {}
+        for component in ALL_COMPONENTS:
+            for storage_type in STORAGE_TYPES:
+                # Main block - settings that are required no matter what is the storage type
+                block = blocks.get(component, blocks["DEFAULT"])
+                # Storage_type specific settings
+                storage_block_name = "{component}_{storage}".format(component=component,
+                                                                    storage=storage_type)
+                storage_block = blocks.get(storage_block_name, blocks["DEFAULT_{0}".format(storage_type)])
+                self.component_blocks[(component, storage_type)] = block + '\n' + storage_block
+
+    def changed(self):
+        """ Whether the files were modified since they were loaded """
+        return templates_mtime(self.blocks_path, self.template_path) != self.mtime
+
+
+def get_templates():
+    """ The TemplateSet of this process, loaded on first use """
+    global _templates
+    if _templates is None:
+        _templates = TemplateSet()
+    return _templates
+
+
+def format_block(component, storage_type, format_args, templates=None):
     """ Format the block from the templates """
-
-    # Main block - settings that are required no matter what is the storage type
-    block_file = BLOCKS_PATH + "/{0}.ini".format(component)
-
-    if not os.path.exists(block_file):
-        block_file = BLOCKS_PATH + "/DEFAULT.ini"
-
-    with open(block_file, 'r') as f:
-        component_block_template = f.read()
-
-    # Storage_type specific settings
-    storage_block_file = BLOCKS_PATH + "/{component}_{storage}.ini".format(component=component,
-                                                                           storage=storage_type)
-    if not os.path.exists(storage_block_file):
-        storage_block_file = BLOCKS_PATH + "/DEFAULT_{0}.ini".format(storage_type)
-
-    with open(storage_block_file, 'r') as f:
-        component_block_template += '\n'
-        component_block_template += f.read()
-
+    if templates is None:
+        templates = get_templates()
     format_args['component'] = component
-    return component_block_template.format(**format_args)
+    return templates.component_blocks[(component, storage_type)].format(**format_args)
 
 
-def create_inventory(master, infra, compute, args):
-    """ Create inventory file from template. `args` are the command line arguments """
+def write_inventory(out, master, infra, compute, args, templates=None):
+    """ Write an inventory file to `out`, section by section. `args` are the command line arguments """
+    if templates is None:
+        templates = get_templates()
 
     # Build host specs
     master_hostname = format_host("master", args.name_prefix, 1, master,
@@ -132,12 +189,13 @@ def create_inventory(master, infra, compute, args):
     master_spec = "{master_hostname} openshift_hostname={master_hostname}".format(master_hostname=master_hostname)
 
     # prepare arguments for formatting the template
-    format_args = vars(args)  # start with the command line arguments
+    format_args = dict(vars(args))  # start with the command line arguments
 
     # Build the spec for the nodes
     format_args['master_spec'] = master_spec
-    format_args['infra_spec'] = build_spec("infra", infra, args.name_prefix, args.wildcard_dns)
-    format_args['compute_spec'] = build_spec("compute", compute, args.name_prefix, args.wildcard_dns)
+    # (the node lists are streamed to `out`, see NODE_SPEC_FIELDS)
+    format_args['infra_spec'] = iter_spec("infra", infra, args.name_prefix, args.wildcard_dns)
+    format_args['compute_spec'] = iter_spec("compute", compute, args.name_prefix, args.wildcard_dns)
     format_args['infra_router_ip'] = infra[0]
 
     if args.storage == 'internal_nfs':
@@ -164,23 +222,40 @@ def create_inventory(master, infra, compute, args):
         # This componet is enabled, fromat the block
         format_args[component + '_block'] = format_block(component,
                                                          args.storage,
-                                                         format_args)
+                                                         format_args,
+                                                         templates)
+
+    for literal, field_name, format_spec in templates.sections:
+        out.write(literal)
+        if field_name is None:
+            continue
+        if field_name in NODE_SPEC_FIELDS:
+            for line in format_args[field_name]:
+                out.write(line)
+        else:
+            out.write(format(format_args[field_name], format_spec))
 
-    # read the main template
 
-    with open(PATH+"/inventory-template.ini", "r") as f:
-        template = f.read()
+def render_inventory(master, infra, compute, args, templates=None):
+    """ Render an inventory file from the templates. `args` are the command line arguments """
+    out = io.StringIO()
+    write_inventory(out, master, infra, compute, args, templates)
+    return out.getvalue()
 
-    print(template.format(**format_args))
 
+def create_inventory(master, infra, compute, args, out=sys.stdout):
+    """ Create inventory file from template. `args` are the command line arguments """
+    write_inventory(out, master, infra, compute, args)
+    out.write('\n')
 
-def main():
-    # Parse command line arguments
+
+def build_parser():
+    """ Build the command line parser """
     parser = argparse.ArgumentParser(description='Build inventory file for openshift-ansible')
 
     # options for storage
     parser.add_argument('--storage', nargs='?', default="external_nfs",
-                        choices=['external_nfs', 'internal_nfs'])
+                        choices=STORAGE_TYPES)
     parser.add_argument('--nfs-server', nargs='?', type=str)
     parser.add_argument('--nfs-export-path', nargs='?', type=str)
 
@@ -205,9 +280,11 @@ def main():
     parser.add_argument('--master-ip', type=str, required=True)
     parser.add_argument('--infra-ips', type=str, required=True)
     parser.add_argument('--compute-ips', type=str, required=True)
+    return parser
 
-    args = parser.parse_args()
 
+def validate_args(args):
+    """ Validate the parsed arguments, return the master, infra and compute IPs """
     # Make sure external NFS is properly defined
     if args.storage == "external_nfs":
         if args.nfs_server is None or args.nfs_export_path is None:
@@ -232,7 +309,97 @@ def main():
     if not set(infra_list).isdisjoint(compute_list):
         raise SystemExit("Can't create inventory: Same IP used for both an infra node and a compute node. This is not supported.")
 
+    return master, infra_list, compute_list
+
+
+def spec_to_argv(spec):
+    """ Convert a cluster spec (command line options as keys) to command line arguments """
+    argv = []
+    for key, value in sorted(spec.items()):
+        if key == "output":
+            continue
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        elif isinstance(value, (list, tuple)):
+            value = " ".join(value)
+        argv.append("--{0}={1}".format(key.replace("_", "-"), value))
+    return argv
+
+
+def load_specs(path):
+    """ Load cluster specs from a JSON (a list), JSON lines or a YAML file """
+    with open(path, 'r') as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        if path.endswith(".json"):
+            specs = json.load(f)
+            if not isinstance(specs, list):
+                raise Exception("{0} should hold a list of cluster specs".format(path))
+            return specs
+        # only needed (and imported) for YAML spec files
+        import yaml
+        return yaml.safe_load(f)
+
+
+def render_batch(specs, output_dir, templates=None):
+    """ Render an inventory per cluster spec into output_dir, return the written paths
+
+    Every spec holds the command line options of a single inventory (e.g.
+    {"name_prefix": "ocp1", "master_ip": ..., "infra_ips": [...]}); the
+    file name defaults to <name_prefix>.ini and can be set with "output".
+    """
+    if templates is None:
+        templates = get_templates()
+    parser = build_parser()
+    written = []
+    for spec in specs:
+        args = parser.parse_args(spec_to_argv(spec))
+        master, infra_list, compute_list = validate_args(args)
+        path = os.path.join(output_dir, spec.get("output", "{0}.ini".format(args.name_prefix)))
+        with io.open(path, 'w', encoding='utf-8') as f:
+            write_inventory(f, master, infra_list, compute_list, args, templates)
+            f.write('\n')
+        written.append(path)
+    return written
+
+
+def main():
+    # cheap, create_inventory is imported by provisiond only once it's running
+    import provisiond
+    # Batch mode: render many inventories from a spec file in one process
+    batch_parser = argparse.ArgumentParser(add_help=False)
+    batch_parser.add_argument('--batch', type=str)
+    batch_parser.add_argument('--output-dir', type=str, default=".")
+    # Render through the provisiond listening on this socket, when it runs
+    batch_parser.add_argument('--daemon-socket', type=str,
+                              default=os.environ.get(provisiond.SOCKET_ENV_VAR))
+    batch_args, remaining = batch_parser.parse_known_args()
+    if batch_args.batch:
+        specs = load_specs(batch_args.batch)
+        sock = provisiond.connect(batch_args.daemon_socket)
+        if sock is None:
+            for path in render_batch(specs, batch_args.output_dir):
+                print(path)
+            return
+        with closing(sock):
+            for spec in specs:
+                spec = dict(spec)
+                spec["output"] = os.path.abspath(os.path.join(batch_args.output_dir, spec.get(
+                    "output", "{0}.ini".format(spec["name_prefix"]))))
+                print(provisiond.request(sock, "inventory", spec=spec))
+        return
+
+    # Parse command line arguments
+    args = build_parser().parse_args(remaining)
+    sock = provisiond.connect(batch_args.daemon_socket)
+    if sock is not None:
+        spec = dict((key, value) for key, value in vars(args).items() if value is not None)
+        with closing(sock):
+            print(provisiond.request(sock, "inventory", spec=spec))
+        return
+    master, infra_list, compute_list = validate_args(args)
     create_inventory(master, infra_list, compute_list, args)
 
+
 if __name__ == "__main__":
     main()
@@ -1,17 +1,14 @@
 #! /bin/bash
 BUILD_DIR="${WORKSPACE}/${BUILD_ID}"
-PV_FILE_TEMPLATE="${WORKSPACE}/pv-template.yaml"
 INVENTORY_PATH="${BUILD_DIR}/inventory.ini"
 OPENSHIFT_ANSIBLE_PATH="${BUILD_DIR}/openshift-ansible"
 ENVIRONMENT_FILE="${BUILD_DIR}/environment"
+FACTS_FILE="${BUILD_DIR}/cluster-facts.json"
 ID_FILE="${WORKSPACE}/../id_rsa"
 REDHAT_IT_ROOT_CA_PATH="/etc/pki/ca-trust/source/anchors/RH-IT-Root-CA.crt"
 NAME_PREFIX="${NAME_PREFIX:-ocp}"
-EXT_NFS_BASE_EXPORT_PATH_NORMALIZED=$(echo ${EXT_NFS_BASE_EXPORT_PATH} | sed 's./.\\/.g')
-CLUSTER_EXT_NFS_BASE_EXPORT_PATH="${EXT_NFS_BASE_EXPORT_PATH_NORMALIZED}\/${NAME_PREFIX}"
 CLUSTER_EXT_NFS_BASE_EXPORT_PATH_UNESCAPED="${EXT_NFS_BASE_EXPORT_PATH}/${NAME_PREFIX}"
 TMP_MNT_PATH="${BUILD_DIR}/mnt"
-TMP_RESOURCE_DIR="${BUILD_DIR}/${NAME_PREFIX}_PVs"
 PREDEFINED_PVS_TO_CREATE="registry metrics logging loggingops prometheus prometheus-alertmanager prometheus-alertbuffer miq-app miq-db"
 MANAGEIQ_IMAGE="${MANAGEIQ_IMAGE:-docker.io/containermgmt/manageiq-pods}"
 SSH_ARGS="-o StrictHostKeyChecking=no -o ControlMaster=auto -o ControlPersist=600s"
@@ -46,23 +43,11 @@ if [ "${STORAGE_TYPE}" == "external_nfs" ]; then
     mkdir ${TMP_MNT_PATH}
     sudo mount ${EXT_NFS_SERVER}:${EXT_NFS_BASE_EXPORT_PATH} ${TMP_MNT_PATH}
     sudo_mkdir_if_not_exist  "${TMP_MNT_PATH}/${NAME_PREFIX}"
-    mkdir ${TMP_RESOURCE_DIR}
-    cd ${TMP_MNT_PATH}/${NAME_PREFIX}
-    for PV_FOLDER in ${PREDEFINED_PVS_TO_CREATE}
-    do
-	    sudo_mkdir_if_not_exist "${PV_FOLDER}"
-    done
-    for PV_FOLDER in `seq -f "vol-%03g" 1 ${NUM_OF_PVS}`
-    do
-	    sudo_mkdir_if_not_exist  "${PV_FOLDER}"
-	    cp ${PV_FILE_TEMPLATE} ${TMP_RESOURCE_DIR}/${PV_FOLDER}.yaml
-	    sed -i "s/#VOL_NAME#/${PV_FOLDER}/g" ${TMP_RESOURCE_DIR}/${PV_FOLDER}.yaml
-	    sed -i "s/#EXPORT_BASE#/${CLUSTER_EXT_NFS_BASE_EXPORT_PATH}/g" ${TMP_RESOURCE_DIR}/${PV_FOLDER}.yaml
-	    sed -i "s/#NFS_SERVER#/${EXT_NFS_SERVER}/g" ${TMP_RESOURCE_DIR}/${PV_FOLDER}.yaml
-
-    done
-    sudo chmod 777 *
-    cd ${BUILD_DIR}
+    # The export directories of the predefined & numbered PVs, the PVs
+    # themselves are created once the cluster is up
+    sudo python "${WORKSPACE}/pv_manifest.py" --export-root="${TMP_MNT_PATH}/${NAME_PREFIX}" \
+                                              --extra-dirs="${PREDEFINED_PVS_TO_CREATE}" \
+                                              --volumes="${NUM_OF_PVS}"
     sudo umount ${TMP_MNT_PATH}
 fi
 
@@ -123,46 +108,20 @@ if [ "${INSTALL_PROMETHEUS}" == "true" ]; then
     # We're installing Prometheus, this means we have to connect to all
     # nodes on the cluster to make sure the iscsi initator name is set correctly
     # and to collect the initator names so we can create the iscsi LUN.
-    echo "Setting initator names..."
-    INITATORS=""
-
-    function set_iname() {
-        NODE_TYPE=${1}
-        NODE_NUMBER=${2}
-        IP=${3}
-
-        printf -v NODE_NUMBER_PADDED "%03d" "${NODE_NUMBER}"
-        INAME="iqn.1994-05.com.redhat:${NAME_PREFIX}-${NODE_TYPE}${NODE_NUMBER_PADDED}"
-        sshpass -p"${ROOT_PASSWORD}" ssh ${SSH_ARGS} "root@${IP}" "echo InitiatorName=${INAME} > /etc/iscsi/initiatorname.iscsi; systemctl restart iscsi.service"
-        INITIATORS="${INITIATORS} ${INAME}"
-    }
-
-    set_iname master 1 ${MASTER_HOSTNAME}
-
-    NODE_NUMBER=1;
-    for IP in ${INFRA_IPS}; do
-        set_iname infra ${NODE_NUMBER} "${IP}"
-        NODE_NUMBER=$((NODE_NUMBER+1))
-    done
-
-    NODE_NUMBER=1;
-    for IP in ${COMPUTE_IPS}; do
-        set_iname compute ${NODE_NUMBER} "${IP}"
-        NODE_NUMBER=$((NODE_NUMBER+1))
-    done
-
-    echo "Initiators: ${INITIATORS}"
-    echo
-    echo "Creating iscsi LUN..."
-
+    # All the nodes are prepared at the same time, and the LUN is created
+    # for the initiators they got.
     set -e
-    ISCSI_LUN_ID=$(python "${WORKSPACE}/lun_manager.py" --server="${NETAPP_SERVER}" \
-                                                        --user="${NETAPP_USER}" \
-                                                        --name="cm-${NAME_PREFIX}" \
-                                                        --volume="${NETAPP_VOLUME}" \
-                                                        --vserver="${NETAPP_VSERVER}" \
-                                                        --size="${ISCSI_PV_SIZE}" \
-                                                        --initiators="${INITIATORS}")
+    export ROOT_PASSWORD
+    ISCSI_LUN_ID=$(python "${WORKSPACE}/node_prep.py" --name-prefix="${NAME_PREFIX}" \
+                                                      --master-host="${MASTER_HOSTNAME}" \
+                                                      --infra-ips="${INFRA_IPS}" \
+                                                      --compute-ips="${COMPUTE_IPS}" \
+                                                      --netapp-server="${NETAPP_SERVER}" \
+                                                      --netapp-username="${NETAPP_USER}" \
+                                                      --lun-name="cm-${NAME_PREFIX}" \
+                                                      --volume="${NETAPP_VOLUME}" \
+                                                      --vserver="${NETAPP_VSERVER}" \
+                                                      --size="${ISCSI_PV_SIZE}")
     set +e
     export ISCSI_LUN_ID
 fi
@@ -183,28 +142,24 @@ if [ $? -ne '0' ]; then
   RETRCODE=1
 fi
 
+# All the PVs are rendered into one manifest and created with a single `oc create`
+PV_ARGS=""
 if [ "${INSTALL_PROMETHEUS}" == "true" ]; then
-    echo "Creating iSCSI pv (for Prometheus)..."
+    # iSCSI pv (for Prometheus)
     export ISCSI_TARGET_PORTAL
     export ISCSI_IQN
-    envsubst < "${WORKSPACE}/iscsi-pv-template.yaml" > iscsi_pv.yaml
-    sshpass -p${ROOT_PASSWORD} rsync -e "ssh ${SSH_ARGS}" -Pahvz iscsi_pv.yaml root@${MASTER_HOSTNAME}:
-    ${SSH_COMMAND} oc create -f iscsi_pv.yaml
+    PV_ARGS="--iscsi"
+fi
+if [ "$RETRCODE" == "0" ] && [ "${STORAGE_TYPE}" == "external_nfs" ]; then
+    PV_ARGS="${PV_ARGS} --volumes=${NUM_OF_PVS} --nfs-server=${EXT_NFS_SERVER} --export-base=${CLUSTER_EXT_NFS_BASE_EXPORT_PATH_UNESCAPED}"
+fi
+if [ -n "${PV_ARGS}" ]; then
+    echo "Creating PVs..."
+    export ROOT_PASSWORD
+    python "${WORKSPACE}/pv_manifest.py" ${PV_ARGS} --apply-host="${MASTER_HOSTNAME}"
 fi
 
 if [ "$RETRCODE" == "0" ]; then
-    if [ "${STORAGE_TYPE}" == "external_nfs" ]; then
-          echo "Creating PVs..."
-          sshpass -p${ROOT_PASSWORD} rsync -e "ssh ${SSH_ARGS}" -Pahvz ${TMP_RESOURCE_DIR} root@${MASTER_HOSTNAME}:
-
-          PV_YAML_DIR=$(basename ${TMP_RESOURCE_DIR})
-
-          for PV in $(seq -f "vol-%03g.yaml" 1 ${NUM_OF_PVS})
-          do
-            ${SSH_COMMAND} oc create -f ${PV_YAML_DIR}/${PV}
-          done
-    fi
-
     if [ "$INSTALL_MANAGEIQ" == "true" ] && [ "$CONFIGURE_MANAGEIQ_PROVIDER" == "true" ]; then
 
       echo "Checking out Ansible 2.4..."
@@ -216,13 +171,12 @@ if [ "$RETRCODE" == "0" ]; then
       ansible --version
       echo "Collecting ManageIQ variables..."
 
-      export OPENSHIFT_HAWKULAR_ROUTE="$(${SSH_COMMAND}  oc get route --namespace='openshift-infra' -o go-template --template='{{.spec.host}}' hawkular-metrics 2> /dev/null)"
-      export OPENSHIFT_PROMETHEUS_ALERTS_ROUTE="$(${SSH_COMMAND}  oc get route --namespace='openshift-metrics' -o go-template --template='{{.spec.host}}' alerts 2> /dev/null)"
-      export OPENSHIFT_PROMETHEUS_METRICS_ROUTE="$(${SSH_COMMAND}  oc get route --namespace='openshift-metrics' -o go-template --template='{{.spec.host}}' prometheus 2> /dev/null)"
-      export OPENSHIFT_CFME_ROUTE="$(${SSH_COMMAND}  oc get route --namespace='openshift-management' -o go-template --template='{{.spec.host}}' httpd 2> /dev/null)"
-      export OPENSHIFT_MASTER_HOST="$(${SSH_COMMAND} oc get nodes -o name |grep master |sed -e 's/nodes\///g')"
-      export OPENSHIFT_CA_CRT="$(${SSH_COMMAND} cat /etc/origin/master/ca.crt)"
-      export OPENSHIFT_MANAGEMENT_ADMIN_TOKEN="$(${SSH_COMMAND} oc sa get-token -n management-infra management-admin)"
+      # One round trip to the master, cached in the build dir for reruns;
+      # the plugins find the same facts in ~/cluster-facts.env on the master
+      export ROOT_PASSWORD
+      eval "$(python "${WORKSPACE}/cluster_facts.py" --host="${MASTER_HOSTNAME}" \
+                                                     --cache-file="${FACTS_FILE}" \
+                                                     --upload-env=cluster-facts.env)"
 
       echo "Running ManageIQ ruby scripts"
       sshpass -p${ROOT_PASSWORD} rsync -e "ssh ${SSH_ARGS}" -Pahvz ${WORKSPACE}/miq_scripts root@${MASTER_HOSTNAME}:
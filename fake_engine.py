@@ -0,0 +1,569 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fake_engine.py - Local stand-in for the oVirt engine API, for benchmarks
+#
+# Copyright © 2018 Red Hat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import argparse
+import fnmatch
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+
+# CONSTANTS
+
+API_PATH = "/ovirt-engine/api"
+SSO_TOKEN_PATH = "/ovirt-engine/sso/oauth/token"
+SSO_LOGOUT_PATH = "/ovirt-engine/services/sso-logout"
+# Request counters, as JSON (not part of the engine API)
+STATS_PATH = "/fake/stats"
+
+# /vms/{id}, /vms/{id}/start, /vms/{id}/tags and /vms/{id}/tags/{tag_id}
+AFFINITY_GROUPS_PATTERN = re.compile("^" + API_PATH + "/clusters/([^/]+)/affinitygroups(?:/([^/]+)(?:/(vms))?)?$")
+VM_PATH_PATTERN = re.compile("^" + API_PATH + "/vms/([^/]+)(?:/([a-z]+)(?:/([^/]+))?)?$")
+PAGE_PATTERN = re.compile("page ([0-9]+)")
+
+STATUS_IMAGE_LOCKED = "image_locked"
+STATUS_DOWN = "down"
+STATUS_POWERING_UP = "powering_up"
+STATUS_UP = "up"
+
+# The single cluster, data center and template, whatever their names
+CLUSTER_ID = "1"
+DATA_CENTER_ID = "1"
+TEMPLATE_ID = "1"
+TEMPLATE_DISK_ID = "1"
+# The data domains (id, available bytes), all holding the template disk
+STORAGE_DOMAINS = [("1", 500 * 1024 ** 3), ("2", 800 * 1024 ** 3)]
+
+# Seconds a new VM stays image_locked, powering_up, and up without an IP
+DEFAULT_LOCK_DELAY = 1.0
+DEFAULT_BOOT_DELAY = 2.0
+DEFAULT_IP_DELAY = 1.0
+
+
+class FakeEngine(object):
+    """ The VMs and events of the fake engine
+
+    The VM status moves with time (image_locked -> down after add,
+    powering_up -> up after start, and the IP shows up a bit later), and
+    every status change is published on the events feed. Tags can be
+    created, and assigned to (or removed from) the VMs. For placement, the
+    storage domains of the VM disks and the affinity groups are kept.
+
+    With a `replay` log (see load_replay), the VMs it names follow it
+    instead, and the VMs of other jobs it holds show up on the events feed.
+    """
+
+    def __init__(self, latency=0.0, lock_delay=DEFAULT_LOCK_DELAY, boot_delay=DEFAULT_BOOT_DELAY,
+                 ip_delay=DEFAULT_IP_DELAY, failure_rate=0.0, seed=None, replay=None):
+        self.latency = latency
+        self.lock_delay = lock_delay
+        self.boot_delay = boot_delay
+        self.ip_delay = ip_delay
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.vms = {}
+        self.events = []
+        self.tags = {}
+        self.affinity_groups = {}
+        self.disk_domains = Counter()
+        self.ids = itertools.count(1)
+        self.tag_ids = itertools.count(1)
+        self.group_ids = itertools.count(1)
+        self.event_ids = itertools.count(1)
+        self.requests = Counter()
+        # {vm name: {"add" / "start": [entries]}}, and the other jobs' entries as (time, entry)
+        self.scripts = {}
+        self.foreign = []
+        started = time.time()
+        for entry in replay or []:
+            if "after" in entry:
+                self.scripts.setdefault(entry["vm"], {}).setdefault(entry["after"], []).append(entry)
+            else:
+                self.foreign.append((started + entry["offset"], entry))
+        self.foreign.sort(key=lambda item: item[0])
+
+    def _event(self, vm):
+        self.events.append((next(self.event_ids), vm["id"]))
+
+    def _set_status(self, vm, status, until=None):
+        vm["status"] = status
+        vm["until"] = until
+        self._event(vm)
+
+    def _advance(self):
+        """ Move the VMs whose current status has timed out """
+        now = time.time()
+        for vm in self.vms.values():
+            # catch up on every step that timed out since the last call
+            while vm["until"] is not None and vm["until"] <= now:
+                self._step(vm)
+            while vm["script"] and vm["script"][0][0] <= now:
+                self._replay(vm, vm["script"].pop(0)[1])
+        while self.foreign and self.foreign[0][0] <= now:
+            entry = self.foreign.pop(0)[1]
+            self.events.append((next(self.event_ids), "foreign-" + entry["vm"]))
+
+    def _replay(self, vm, entry):
+        if "status" in entry:
+            self._set_status(vm, entry["status"])
+        if "ip" in entry:
+            # like on a real engine, the guest reporting its IP is no event
+            vm["ip"] = entry["ip"]
+
+    def _schedule(self, vm, action):
+        """ Queue the replay entries of a VM following an action, return False if there are none """
+        entries = self.scripts.get(vm["name"], {}).get(action)
+        if not entries:
+            return False
+        now = time.time()
+        vm["script"] = sorted(vm["script"] + [(now + entry["offset"], entry) for entry in entries],
+                              key=lambda item: item[0])
+        return True
+
+    def _step(self, vm):
+        if vm["status"] == STATUS_IMAGE_LOCKED:
+            self._set_status(vm, STATUS_DOWN)
+        elif vm["status"] == STATUS_POWERING_UP:
+            self._set_status(vm, STATUS_UP, vm["until"] + self.ip_delay)
+        elif vm["status"] == STATUS_UP:
+            number = int(vm["id"])
+            vm["ip"] = "10.{0}.{1}.{2}".format(number // 65536 % 256, number // 256 % 256, number % 256)
+            vm["until"] = None
+            self._event(vm)
+        else:
+            vm["until"] = None
+
+    def should_fail(self):
+        return self.failure_rate > 0 and self.random.random() < self.failure_rate
+
+    def add_vm(self, name, status=STATUS_IMAGE_LOCKED, disk_domains=()):
+        with self.lock:
+            self.disk_domains.update(disk_domains)
+            vm = {"id": str(next(self.ids)), "name": name, "ip": None, "until": None, "tags": set(),
+                  "script": []}
+            self.vms[vm["id"]] = vm
+            self._set_status(vm, status, time.time() + self.lock_delay if status == STATUS_IMAGE_LOCKED else None)
+            if status == STATUS_IMAGE_LOCKED and self._schedule(vm, "add"):
+                vm["until"] = None
+            return dict(vm)
+
+    def list_vms(self, search=None, max_=None):
+        with self.lock:
+            self._advance()
+            vms = sorted(self.vms.values(), key=lambda vm: vm["name"])
+            pattern = None
+            tag = None
+            page = 1
+            for part in (search or "").split(" and "):
+                if part.startswith("name="):
+                    pattern = part[len("name="):]
+                if part.startswith("tag="):
+                    tag = part[len("tag="):]
+                match = PAGE_PATTERN.search(part)
+                if match:
+                    page = int(match.group(1))
+            if pattern is not None:
+                vms = [vm for vm in vms if fnmatch.fnmatchcase(vm["name"], pattern)]
+            if tag is not None:
+                vms = [vm for vm in vms if any(self.tags[tag_id] == tag for tag_id in vm["tags"])]
+            if max_ is not None:
+                vms = vms[(page - 1) * max_:page * max_]
+            return [dict(vm) for vm in vms]
+
+    def vm_action(self, vm_id, action):
+        """ Run a start / stop action, return False if the VM doesn't exist """
+        with self.lock:
+            self._advance()
+            vm = self.vms.get(vm_id)
+            if vm is None:
+                return False
+            if action == "start":
+                if not self._schedule(vm, "start"):
+                    self._set_status(vm, STATUS_POWERING_UP, time.time() + self.boot_delay)
+            else:
+                vm["ip"] = None
+                vm["script"] = []
+                self._set_status(vm, STATUS_DOWN)
+            return True
+
+    def rename_vm(self, vm_id, name):
+        """ Rename a VM, return it (None if it doesn't exist) """
+        with self.lock:
+            self._advance()
+            vm = self.vms.get(vm_id)
+            if vm is None:
+                return None
+            vm["name"] = name
+            return dict(vm)
+
+    def remove_vm(self, vm_id):
+        with self.lock:
+            return self.vms.pop(vm_id, None) is not None
+
+    def add_tag(self, name):
+        """ Create a tag, return its id (None if the name is taken) """
+        with self.lock:
+            if name in self.tags.values():
+                return None
+            tag_id = str(next(self.tag_ids))
+            self.tags[tag_id] = name
+            return tag_id
+
+    def list_tags(self, vm_id=None):
+        """ The (id, name) of all the tags, or those of a VM (None if it doesn't exist) """
+        with self.lock:
+            if vm_id is None:
+                tag_ids = self.tags
+            elif vm_id in self.vms:
+                tag_ids = self.vms[vm_id]["tags"]
+            else:
+                return None
+            return sorted((tag_id, self.tags[tag_id]) for tag_id in tag_ids)
+
+    def assign_tag(self, vm_id, name):
+        """ Assign an existing tag to a VM, return its id (None if either doesn't exist) """
+        with self.lock:
+            tag_ids = [tag_id for tag_id, tag in self.tags.items() if tag == name]
+            if vm_id not in self.vms or not tag_ids:
+                return None
+            self.vms[vm_id]["tags"].add(tag_ids[0])
+            return tag_ids[0]
+
+    def unassign_tag(self, vm_id, tag_id):
+        """ Remove a tag from a VM, return False if the VM doesn't carry it """
+        with self.lock:
+            vm = self.vms.get(vm_id)
+            if vm is None or tag_id not in vm["tags"]:
+                return False
+            vm["tags"].discard(tag_id)
+            return True
+
+    def add_affinity_group(self, name, positive, enforcing):
+        """ Create an affinity group, return its id (None if the name is taken) """
+        with self.lock:
+            if any(group["name"] == name for group in self.affinity_groups.values()):
+                return None
+            group_id = str(next(self.group_ids))
+            self.affinity_groups[group_id] = {"id": group_id, "name": name, "positive": positive,
+                                              "enforcing": enforcing, "vms": set()}
+            return group_id
+
+    def list_affinity_groups(self):
+        with self.lock:
+            return [dict(group, vms=set(group["vms"])) for _, group in sorted(self.affinity_groups.items())]
+
+    def add_to_affinity_group(self, group_id, vm_id):
+        """ Return False if the group or the VM doesn't exist """
+        with self.lock:
+            if group_id not in self.affinity_groups or vm_id not in self.vms:
+                return False
+            self.affinity_groups[group_id]["vms"].add(vm_id)
+            return True
+
+    def remove_affinity_group(self, group_id):
+        with self.lock:
+            return self.affinity_groups.pop(group_id, None) is not None
+
+    def list_events(self, from_=None, max_=None):
+        """ Events newest first, only those after `from_` if set """
+        with self.lock:
+            self._advance()
+            events = [event for event in reversed(self.events) if from_ is None or event[0] > from_]
+            if max_ is not None:
+                events = events[:max_]
+            return events
+
+
+def tag_xml(tag_id, name):
+    return '<tag href="{0}/tags/{1}" id="{1}"><name>{2}</name></tag>'.format(API_PATH, tag_id, escape(name))
+
+
+def affinity_group_xml(group):
+    return ('<affinity_group href="{0}/clusters/{1}/affinitygroups/{2}" id="{2}"><name>{3}</name>'
+            '<positive>{4}</positive><enforcing>{5}</enforcing></affinity_group>').format(
+                API_PATH, CLUSTER_ID, group["id"], escape(group["name"]),
+                str(group["positive"]).lower(), str(group["enforcing"]).lower())
+
+
+def vm_xml(vm, follow=None):
+    parts = ['<vm href="{0}/vms/{1}" id="{1}">'.format(API_PATH, vm["id"]),
+             "<name>{0}</name>".format(escape(vm["name"])),
+             "<status>{0}</status>".format(vm["status"])]
+    if follow and "reported_devices" in follow:
+        parts.append("<reported_devices>")
+        if vm["ip"]:
+            parts.append("<reported_device><name>eth0</name><ips><ip>"
+                         "<address>{0}</address><version>v4</version>"
+                         "</ip></ips></reported_device>".format(vm["ip"]))
+        parts.append("</reported_devices>")
+    parts.append("</vm>")
+    return "".join(parts)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """ Serves the subset of the engine API the SDK uses for our VMs """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body="", content_type="application/xml"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _fault(self, status, detail):
+        self._reply(status, "<fault><reason>Operation Failed</reason>"
+                            "<detail>[{0}]</detail></fault>".format(escape(detail)))
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length).decode("utf-8") if length else ""
+
+    def _route(self, method):
+        engine = self.server.engine
+        url = urlsplit(self.path)
+        query = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        body = self._body()
+        path = url.path.rstrip("/")
+        if path == STATS_PATH:
+            return self._reply(200, json.dumps(dict(engine.requests)), "application/json")
+
+        match = VM_PATH_PATTERN.match(path)
+        kind = "{0} {1}".format(method, path if match is None else
+                                "vms/{id}" + ("/" + match.group(2) if match.group(2) else "") +
+                                ("/{id}" if match.group(3) else ""))
+        engine.requests[kind] += 1
+        if engine.latency:
+            time.sleep(engine.latency)
+
+        if path == SSO_TOKEN_PATH:
+            return self._reply(200, json.dumps({"access_token": "fake-token", "token_type": "Bearer"}),
+                               "application/json")
+        if path == SSO_LOGOUT_PATH:
+            # the SDK parses the logout answer as JSON
+            return self._reply(200, "{}", "application/json")
+        if path == API_PATH:
+            return self._reply(200, "<api></api>")
+        if path == API_PATH + "/vms" and method == "GET":
+            max_ = int(query["max"]) if "max" in query else None
+            vms = engine.list_vms(query.get("search"), max_)
+            return self._reply(200, "<vms>" + "".join(vm_xml(vm, query.get("follow")) for vm in vms) + "</vms>")
+        if path == API_PATH + "/vms" and method == "POST":
+            if engine.should_fail():
+                return self._fault(409, "injected add failure")
+            vm = ElementTree.fromstring(body)
+            domains = [domain.get("id") for domain in vm.findall(
+                "disk_attachments/disk_attachment/disk/storage_domains/storage_domain")]
+            return self._reply(201, vm_xml(engine.add_vm(vm.findtext("name"), disk_domains=domains)))
+        if match is not None and method == "POST" and match.group(2) in ("start", "stop"):
+            if engine.should_fail():
+                return self._fault(409, "injected {0} failure".format(match.group(2)))
+            if not engine.vm_action(match.group(1), match.group(2)):
+                return self._fault(404, "VM not found")
+            return self._reply(200, "<action><status>complete</status></action>")
+        if match is not None and method == "PUT" and match.group(2) is None:
+            if engine.should_fail():
+                return self._fault(409, "injected update failure")
+            vm = engine.rename_vm(match.group(1), ElementTree.fromstring(body).findtext("name"))
+            if vm is None:
+                return self._fault(404, "VM not found")
+            return self._reply(200, vm_xml(vm))
+        if match is not None and method == "DELETE" and match.group(2) is None:
+            if not engine.remove_vm(match.group(1)):
+                return self._fault(404, "VM not found")
+            return self._reply(200)
+        if match is not None and match.group(2) == "tags" and match.group(3) is None:
+            if method == "GET":
+                tags = engine.list_tags(match.group(1))
+                if tags is None:
+                    return self._fault(404, "VM not found")
+                return self._reply(200, "<tags>" + "".join(tag_xml(*tag) for tag in tags) + "</tags>")
+            if method == "POST":
+                name = ElementTree.fromstring(body).findtext("name")
+                tag_id = engine.assign_tag(match.group(1), name)
+                if tag_id is None:
+                    return self._fault(404, "VM or tag not found")
+                return self._reply(201, tag_xml(tag_id, name))
+        if match is not None and match.group(2) == "tags" and method == "DELETE":
+            # only one of the callers removing the same tag gets it
+            if not engine.unassign_tag(match.group(1), match.group(3)):
+                return self._fault(404, "VM doesn't carry this tag")
+            return self._reply(200)
+        if path == API_PATH + "/clusters" and method == "GET":
+            name = query.get("search", "name=Default")[len("name="):]
+            return self._reply(200, '<clusters><cluster id="{0}"><name>{1}</name><data_center id="{2}"/>'
+                                    '</cluster></clusters>'.format(CLUSTER_ID, escape(name), DATA_CENTER_ID))
+        if path == "{0}/datacenters/{1}/storagedomains".format(API_PATH, DATA_CENTER_ID) and method == "GET":
+            return self._reply(200, "<storage_domains>" + "".join(
+                '<storage_domain id="{0}"><name>data{0}</name><type>data</type><status>active</status>'
+                '<available>{1}</available></storage_domain>'.format(*domain) for domain in STORAGE_DOMAINS) +
+                "</storage_domains>")
+        if path == API_PATH + "/templates" and method == "GET":
+            name = query.get("search", "name=Blank")[len("name="):]
+            return self._reply(200, '<templates><template id="{0}"><name>{1}</name></template>'
+                                    '</templates>'.format(TEMPLATE_ID, escape(name)))
+        if path == "{0}/templates/{1}/diskattachments".format(API_PATH, TEMPLATE_ID) and method == "GET":
+            domains = "".join('<storage_domain id="{0}"/>'.format(domain_id) for domain_id, _ in STORAGE_DOMAINS)
+            return self._reply(200, '<disk_attachments><disk_attachment id="{0}"><disk id="{0}"><storage_domains>'
+                                    '{1}</storage_domains></disk></disk_attachment></disk_attachments>'.format(
+                                        TEMPLATE_DISK_ID, domains))
+        group_match = AFFINITY_GROUPS_PATTERN.match(path)
+        if group_match is not None and group_match.group(1) == CLUSTER_ID:
+            group_id = group_match.group(2)
+            if group_id is None and method == "GET":
+                return self._reply(200, "<affinity_groups>" + "".join(
+                    affinity_group_xml(group) for group in engine.list_affinity_groups()) + "</affinity_groups>")
+            if group_id is None and method == "POST":
+                group = ElementTree.fromstring(body)
+                group = {"name": group.findtext("name"), "positive": group.findtext("positive") == "true",
+                         "enforcing": group.findtext("enforcing") == "true"}
+                group["id"] = engine.add_affinity_group(group["name"], group["positive"], group["enforcing"])
+                if group["id"] is None:
+                    return self._fault(409, "affinity group name is in use")
+                return self._reply(201, affinity_group_xml(group))
+            if group_match.group(3) == "vms" and method == "POST":
+                vm_id = ElementTree.fromstring(body).get("id")
+                if not engine.add_to_affinity_group(group_id, vm_id):
+                    return self._fault(404, "affinity group or VM not found")
+                return self._reply(201, '<vm id="{0}"/>'.format(escape(vm_id)))
+            if group_match.group(3) is None and method == "DELETE":
+                if not engine.remove_affinity_group(group_id):
+                    return self._fault(404, "affinity group not found")
+                return self._reply(200)
+        if path == API_PATH + "/tags" and method == "GET":
+            return self._reply(200, "<tags>" + "".join(tag_xml(*tag) for tag in engine.list_tags()) + "</tags>")
+        if path == API_PATH + "/tags" and method == "POST":
+            name = ElementTree.fromstring(body).findtext("name")
+            tag_id = engine.add_tag(name)
+            if tag_id is None:
+                return self._fault(409, "tag name is in use")
+            return self._reply(201, tag_xml(tag_id, name))
+        if path == API_PATH + "/events" and method == "GET":
+            from_ = int(query["from"]) if "from" in query else None
+            max_ = int(query["max"]) if "max" in query else None
+            events = engine.list_events(from_, max_)
+            return self._reply(200, "<events>" + "".join('<event id="{0}"><vm id="{1}"/></event>'.format(*event)
+                                                         for event in events) + "</events>")
+        return self._fault(404, "{0} {1} is not faked".format(method, path))
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_PUT(self):
+        self._route("PUT")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, engine):
+        self.engine = engine
+        HTTPServer.__init__(self, address, RequestHandler)
+
+    @property
+    def url(self):
+        return "http://{0}:{1}{2}".format(self.server_address[0], self.server_address[1], API_PATH)
+
+
+def start_server(engine, host="127.0.0.1", port=0):
+    """ Serve the engine from a background thread, return the server (see its url) """
+    server = Server((host, port), engine)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def add_engine_args(parser):
+    """ Add the fake engine behaviour arguments to an argumentparser """
+    parser.add_argument('--latency', nargs='?', type=float, default=0.0,
+                        help="Seconds added to every request")
+    parser.add_argument('--lock-delay', nargs='?', type=float, default=DEFAULT_LOCK_DELAY,
+                        help="Seconds a new VM stays image locked")
+    parser.add_argument('--boot-delay', nargs='?', type=float, default=DEFAULT_BOOT_DELAY,
+                        help="Seconds a started VM stays powering up")
+    parser.add_argument('--ip-delay', nargs='?', type=float, default=DEFAULT_IP_DELAY,
+                        help="Seconds an up VM takes to report its IP")
+    parser.add_argument('--failure-rate', nargs='?', type=float, default=0.0,
+                        help="Share of the add/start/stop/update requests failing")
+    parser.add_argument('--seed', nargs='?', type=int, default=None)
+
+
+def load_replay(path):
+    """ Load an event log to replay, a JSON list of VM status changes
+
+    Every entry names a VM, and has an offset (in seconds) and a status
+    and/or an IP. With "after": "add" or "start", the offset counts from
+    that request for the VM, otherwise from the engine start, and the
+    entry only shows up on the events feed (another job's VM).
+    """
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def engine_from_args(args, replay=None):
+    return FakeEngine(latency=args.latency, lock_delay=args.lock_delay, boot_delay=args.boot_delay,
+                      ip_delay=args.ip_delay, failure_rate=args.failure_rate, seed=args.seed,
+                      replay=replay)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the oVirt engine API')
+    parser.add_argument('--port', nargs='?', type=int, default=8080)
+    parser.add_argument('--replay', nargs='?', type=str,
+                        help="Event log (JSON) the VMs it names follow, see load_replay")
+    add_engine_args(parser)
+    args = parser.parse_args()
+
+    replay = load_replay(args.replay) if args.replay else None
+    server = Server(("127.0.0.1", args.port), engine_from_args(args, replay))
+    print("fake engine listening on {0}".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fake_ontap.py - Local stand-in for the ONTAP HTTP API, for ontap_rest tests
+#
+# Copyright © 2018 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import argparse
+import itertools
+import json
+import os
+import threading
+import uuid
+from collections import Counter
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qs, urlencode
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+    from urllib import urlencode
+
+# CONSTANTS
+
+LUNS_PATH = "/api/storage/luns"
+IGROUPS_PATH = "/api/protocols/san/igroups"
+LUN_MAPS_PATH = "/api/protocols/san/lun-maps"
+# Query parameters that are not record filters
+CONTROL_PARAMS = ("fields", "max_records", "start", "return_records")
+
+
+class FakeOntap(object):
+    """ The LUNs, igroups and LUN maps of a single vserver
+
+    `drop_after` holds the methods ("POST", "GET", ...) whose next request
+    is processed, and then answered by closing the connection, like a
+    server timing out after doing the work.
+    """
+
+    def __init__(self, vserver):
+        self.vserver = vserver
+        self.lock = threading.Lock()
+        self.luns = {}
+        self.igroups = {}
+        self.maps = []
+        self.lun_numbers = itertools.count(0)
+        self.requests = Counter()
+        self.drop_after = set()
+
+    def add_lun(self, volume, lun_name, size=1024):
+        with self.lock:
+            lun_uuid = str(uuid.uuid4())
+            self.luns[lun_uuid] = {"uuid": lun_uuid, "name": "/vol/{0}/{1}".format(volume, lun_name),
+                                   "space": {"size": size}}
+            return lun_uuid
+
+    def add_igroup(self, name, initiators):
+        with self.lock:
+            igroup_uuid = str(uuid.uuid4())
+            self.igroups[igroup_uuid] = {"uuid": igroup_uuid, "name": name,
+                                         "initiators": [{"name": i} for i in initiators]}
+            return igroup_uuid
+
+    def map_lun(self, lun_name, igroup_name):
+        """ Map a LUN (by path) to an igroup, return the mapping record """
+        with self.lock:
+            lun = self.find_record(self.luns, lun_name)
+            igroup = self.find_record(self.igroups, igroup_name)
+            if lun is None or igroup is None:
+                raise KeyError("no such lun or igroup")
+            if any(m["lun"]["uuid"] == lun["uuid"] and m["igroup"]["uuid"] == igroup["uuid"]
+                   for m in self.maps):
+                raise ValueError("LUN already mapped to this group")
+            mapping = {"lun": {"uuid": lun["uuid"], "name": lun["name"]},
+                       "igroup": {"uuid": igroup["uuid"], "name": igroup["name"]},
+                       "logical_unit_number": next(self.lun_numbers)}
+            self.maps.append(mapping)
+            return mapping
+
+    @staticmethod
+    def find_record(records, name):
+        for record in records.values():
+            if record["name"] == name:
+                return record
+        return None
+
+
+def _get_field(record, dotted):
+    for part in dotted.split("."):
+        if not isinstance(record, dict) or part not in record:
+            return None
+        record = record[part]
+    return record
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """ Serves the subset of the ONTAP API ontap_rest.RestBackend uses """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message):
+        self._reply(status, {"error": {"message": message, "code": str(status)}})
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length).decode("utf-8")) if length else {}
+
+    def _list(self, path, records, query):
+        """ Reply with a page of the records matching the query filters """
+        matching = [record for record in records
+                    if all(str(_get_field(record, key)) == value for key, value in query.items()
+                           if key not in CONTROL_PARAMS and key != "svm.name")]
+        start = int(query.get("start", 0))
+        max_records = int(query.get("max_records", len(matching) or 1))
+        page = matching[start:start + max_records]
+        body = {"records": page, "num_records": len(page), "_links": {}}
+        if start + max_records < len(matching):
+            # like ONTAP, the next link carries the whole query
+            body["_links"]["next"] = {"href": "{0}?{1}".format(path, urlencode(dict(query, start=start + max_records)))}
+        self._reply(200, body)
+
+    def _route(self, method):
+        ontap = self.server.ontap
+        url = urlsplit(self.path)
+        query = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        body = self._body()
+        path = url.path.rstrip("/")
+        parts = path[len("/api/"):].split("/") if path.startswith("/api/") else []
+        ontap.requests["{0} {1}".format(method, path)] += 1
+
+        if path == LUNS_PATH and method == "GET":
+            return self._list(path, sorted(ontap.luns.values(), key=lambda r: r["name"]), query)
+        if path == LUNS_PATH and method == "POST":
+            if ontap.find_record(ontap.luns, body["name"]) is not None:
+                return self._error(409, "duplicate entry")
+            volume, lun_name = body["name"].split("/")[2:4]
+            ontap.add_lun(volume, lun_name, body["space"]["size"])
+            return self._reply(201, {})
+        if path.startswith(LUNS_PATH + "/") and method == "DELETE":
+            if ontap.luns.pop(parts[-1], None) is None:
+                return self._error(404, "entry doesn't exist")
+            return self._reply(200, {})
+
+        if path == IGROUPS_PATH and method == "GET":
+            return self._list(path, sorted(ontap.igroups.values(), key=lambda r: r["name"]), query)
+        if path == IGROUPS_PATH and method == "POST":
+            if ontap.find_record(ontap.igroups, body["name"]) is not None:
+                return self._error(409, "duplicate entry")
+            ontap.add_igroup(body["name"], [i["name"] for i in body.get("initiators", [])])
+            return self._reply(201, {})
+        if path.startswith(IGROUPS_PATH + "/") and path.endswith("/initiators") and method == "POST":
+            igroup = ontap.igroups.get(parts[-2])
+            if igroup is None:
+                return self._error(404, "entry doesn't exist")
+            igroup["initiators"].extend(body["records"])
+            return self._reply(201, {})
+        if path.startswith(IGROUPS_PATH + "/") and method == "DELETE":
+            if ontap.igroups.pop(parts[-1], None) is None:
+                return self._error(404, "entry doesn't exist")
+            return self._reply(200, {})
+
+        if path == LUN_MAPS_PATH and method == "GET":
+            return self._list(path, list(ontap.maps), query)
+        if path == LUN_MAPS_PATH and method == "POST":
+            try:
+                mapping = ontap.map_lun(body["lun"]["name"], body["igroup"]["name"])
+            except KeyError as e:
+                return self._error(404, str(e))
+            except ValueError as e:
+                return self._error(409, str(e))
+            return self._reply(201, {"records": [mapping]} if query.get("return_records") == "true" else {})
+        if path.startswith(LUN_MAPS_PATH + "/") and method == "DELETE":
+            before = len(ontap.maps)
+            ontap.maps = [m for m in ontap.maps
+                          if (m["lun"]["uuid"], m["igroup"]["uuid"]) != (parts[-2], parts[-1])]
+            if len(ontap.maps) == before:
+                return self._error(404, "entry doesn't exist")
+            return self._reply(200, {})
+
+        return self._error(404, "{0} {1} is not faked".format(method, path))
+
+    def _handle(self, method):
+        drop = method in self.server.ontap.drop_after
+        if not drop:
+            return self._route(method)
+        self.server.ontap.drop_after.discard(method)
+        # do the work, but never answer
+        wfile = self.wfile
+        try:
+            self.wfile = open(os.devnull, "wb")
+            self._route(method)
+        finally:
+            self.wfile.close()
+            self.wfile = wfile
+        self.close_connection = True
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, ontap):
+        self.ontap = ontap
+        HTTPServer.__init__(self, address, RequestHandler)
+
+    @property
+    def url(self):
+        return "http://{0}:{1}".format(self.server_address[0], self.server_address[1])
+
+
+def start_server(ontap, host="127.0.0.1", port=0):
+    """ Serve the fake ONTAP from a background thread, return the server (see its url) """
+    server = Server((host, port), ontap)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the ONTAP HTTP API')
+    parser.add_argument('--port', nargs='?', type=int, default=8081)
+    parser.add_argument('--vserver', nargs='?', type=str, default="svm0")
+    args = parser.parse_args()
+
+    server = Server(("127.0.0.1", args.port), FakeOntap(args.vserver))
+    print("fake ONTAP listening on {0}".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
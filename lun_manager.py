@@ -19,22 +19,38 @@
 
 from __future__ import unicode_literals, print_function
 import argparse
-import paramiko
+import json
 import sys
 import ovirt_utils
 import re
 import os
-from paramiko import SSHClient
+from collections import namedtuple
+from contextlib import closing
+from multiprocessing.pool import ThreadPool
 
 size_pattern = re.compile("^\d+(\.\d)?[kmg]?b$", re.I)
 
+DEFAULT_NETAPP_PASS_ENV_VAR = "NETAPP_PASS"
 
-def exec_command(client, command):
-    """ execute a command on an ssh client, return the output streams """
+# Number of LUNs cleaned up at the same time, each worker's commands run
+# on their own channels of the same SSH connection
+DEFAULT_CHANNELS = 8
+
+LunRecord = namedtuple("LunRecord", ["vserver", "volume", "lun"])
+MappingRecord = namedtuple("MappingRecord", ["vserver", "volume", "lun", "igroup", "lun_id"])
+
+
+def _start_command(client, command):
+    """ start a command on a new channel of the ssh connection """
     if ';' in command:
         # minimal effort to prevent shell injection
         raise ValueError("Invalid character ';'")
     stdin, stdout, stderr = client.exec_command(command)
+    return stdout, stderr
+
+
+def _collect_output(stdout, stderr):
+    """ wait for a started command to finish, return the output streams """
     out = stdout.read().strip()
     err = stderr.read().strip()
     if out:
@@ -44,39 +60,72 @@ def exec_command(client, command):
     return out, err
 
 
-def create_lun(client, volume, vserver, lun_name, size):
+def exec_command(client, command):
+    """ execute a command on an ssh client, return the output streams """
+    return _collect_output(*_start_command(client, command))
+
+
+def iter_output_lines(stdout, echo=False):
+    """ yield the lines of a started command's output as they arrive """
+    for line in stdout:
+        line = line.rstrip("\r\n")
+        if echo:
+            print(line, file=sys.stderr)
+        yield line
+
+
+def stream_command(client, command, echo=False):
+    """ execute a command on an ssh client, yield its output lines as they arrive
+
+    Stop iterating (or close the generator) to abandon the rest of the output.
+    """
+    stdout, stderr = _start_command(client, command)
+    try:
+        for line in iter_output_lines(stdout, echo):
+            yield line
+        err = stderr.read().strip()
+        if err:
+            print(err, file=sys.stderr)
+    finally:
+        stdout.channel.close()
+
+
+def create_lun(client, volume, vserver, lun_name, size, snapshot=None):
     """ Create a LUN """
     command = "lun create -vserver {0} -volume {1} -lun {2} -size {3} -ostype linux"
     command = command.format(vserver, volume, lun_name, size)
     out, err = exec_command(client, command)
     if not out.startswith("Created a LUN of size"):
         raise Exception("Lun creation failed\n" + out + '\n' + err)
+    if snapshot is not None:
+        snapshot.luns[lun_name] = volume
 
 
-def create_igroup(client, vserver, igroup_name, initator_list):
+def create_igroup(client, vserver, igroup_name, initator_list, snapshot=None):
     """ Create an igroup """
     command = "igroup create -vserver {0} -igroup {1} -protocol iscsi  -ostype linux -initiator {2}"
     command = command.format(vserver, igroup_name, ", ".join(initator_list))
     out, err = exec_command(client, command)
     if out or err:
         raise Exception("igroup creation failed!")
+    if snapshot is not None:
+        snapshot.igroups[igroup_name] = set(initator_list)
+
+
+def add_initiators(client, vserver, igroup_name, initator_list, snapshot=None):
+    """ Add initiators to an existing igroup """
+    command = "igroup add -vserver {0} -igroup {1} -initiator {2}"
+    command = command.format(vserver, igroup_name, ", ".join(initator_list))
+    out, err = exec_command(client, command)
+    if out or err:
+        raise Exception("failed adding initiators to the igroup!")
+    if snapshot is not None:
+        snapshot.igroups[igroup_name] = snapshot.initiators(igroup_name) | set(initator_list)
 
 
-def verify_igroup(client, vserver, igroup_name, desired_initiators):
+def verify_igroup(backend, igroup_name, desired_initiators, snapshot):
     """ Verify an igroup has all desired initiators and no unknown ones """
-    out, err = exec_command(client, "igroup show {0}".format(igroup_name))
-    # Parse initiators list
-    found_start = False
-    current_initiators = ""
-    for line in out.splitlines():
-        splitted = line.strip().split()
-        if len(splitted) == 0:
-            break
-        if splitted[0] == "vserver-rhev":
-            found_start = True
-        if found_start:
-            current_initiators += splitted[-1]
-    current_initiators = set(current_initiators.split(','))
+    current_initiators = snapshot.initiators(igroup_name)
     desired_initiators = set(desired_initiators)
 
     missing = desired_initiators - current_initiators
@@ -97,11 +146,7 @@ def verify_igroup(client, vserver, igroup_name, desired_initiators):
     if len(missing) > 0:
         print("Missing initiators: {0}".format(missing), file=sys.stderr)
         # add missing initiators
-        command = "igroup add -vserver {0} -igroup {1} -initiator {2}"
-        command = command.format(vserver, igroup_name, ", ".join(missing))
-        out, err = exec_command(client, command)
-        if out or err:
-            raise Exception("failed adding initiators to the igroup!")
+        backend.add_initiators(igroup_name, sorted(missing), snapshot)
         return True
 
 
@@ -116,22 +161,34 @@ def _mapping(mode, client, vserver, volume, lun_name, igroup_name):
         raise Exception("mapping {0} failed".format(mode))
 
 
-def find_lun_id(client, lun_name):
+def find_lun_id(client, lun_name, vserver=None, echo=False):
     """ Find the lun ID (useful for the PV file) """
-    out, err = exec_command(client, "mapping show")
-    for line in out.splitlines():
-        splitted = line.split()
-        if splitted[2] == lun_name:
-            return splitted[3]
+    command = "mapping show"
+    if vserver is not None:
+        command += " -vserver {0}".format(vserver)
+    with closing(stream_command(client, command, echo)) as lines:
+        for mapping in iter_mappings(lines, vserver):
+            if mapping.lun == lun_name:
+                # no need to read the rest of the listing
+                return mapping.lun_id
 
     raise Exception("Could not find LUN ID number")
 
 
-def map_lun(client, vserver, volume, lun_name, igroup_name):
-    """ Map LUN to igroup """
+def refresh_lun_ids(client, vserver, snapshot):
+    """ Re-read the mappings of a snapshot, e.g. to learn the ids the server picked """
+    with closing(stream_command(client, "mapping show -vserver {0}".format(vserver))) as lines:
+        snapshot.lun_ids = parse_mapping_show(lines, vserver)
+
+
+def map_lun(client, vserver, volume, lun_name, igroup_name, snapshot=None):
+    """ Map LUN to igroup, return the LUN id """
     _mapping("create", client, vserver, volume, lun_name, igroup_name)
-    # print the LUN id so the deployer can put it in the PV file
-    print(find_lun_id(client, lun_name))
+    if snapshot is not None:
+        # the id is picked by the server, refresh the mappings to learn it
+        refresh_lun_ids(client, vserver, snapshot)
+        return snapshot.lun_id(lun_name)
+    return find_lun_id(client, lun_name, vserver)
 
 
 def delete_lun_mapping(client, vserver, volume, lun_name, igroup_name):
@@ -157,13 +214,11 @@ def delete_igroup(client, vserver, igroup_name):
         raise Exception("igroup deletion failed!")
 
 
-def get_luns(client, vserver):
-    """ Get a list of LUNs from the NetApp server """
-    out, err = exec_command(client, "lun show -vserver {0}".format(vserver))
-    if "Error" in out:
-        raise Exception("Can't get luns: {0}".format(out))
-    ret = []
-    for line in out.splitlines():
+def iter_luns(lines, vserver):
+    """ Parse `lun show` output lines, yield a LunRecord per LUN """
+    for line in lines:
+        if "Error" in line:
+            raise Exception("Can't get luns: {0}".format(line))
         splitted = line.strip().split()
         if len(splitted) < 2:
             continue
@@ -172,43 +227,373 @@ def get_luns(client, vserver):
             # a warning or the header
             continue
         path = splitted[1].split('/')
-        ret.append({"volume": path[2], "name": path[3]})
+        yield LunRecord(splitted[0], path[2], path[3])
+
+
+def iter_mappings(lines, vserver=None):
+    """ Parse `mapping show` output lines, yield a MappingRecord per mapping """
+    for line in lines:
+        # Vserver Path Igroup LUN-ID Protocol
+        splitted = line.split()
+        if len(splitted) < 4 or not splitted[1].startswith('/vol/'):
+            continue
+        if vserver is not None and splitted[0] != vserver:
+            continue
+        path = splitted[1].split('/')
+        yield MappingRecord(splitted[0], path[2], path[3], splitted[2], splitted[3])
+
+
+def parse_lun_show(lines, vserver):
+    """ Parse `lun show` output lines into {"volume": ..., "name": ...} dicts """
+    return [{"volume": lun.volume, "name": lun.lun} for lun in iter_luns(lines, vserver)]
+
+
+def parse_mapping_show(lines, vserver=None):
+    """ Parse `mapping show` output lines into a {lun name: lun id} dict """
+    return dict((mapping.lun, mapping.lun_id) for mapping in iter_mappings(lines, vserver))
+
+
+def parse_igroup_show(lines, vserver):
+    """ Parse `igroup show` output lines into an {igroup name: set of initiators} dict """
+    ret = {}
+    initiators = {}
+    current = None
+    for line in lines:
+        splitted = line.strip().split()
+        if len(splitted) == 0:
+            current = None
+            continue
+        if splitted[0] == vserver and len(splitted) >= 5:
+            # Vserver Igroup Protocol OS-Type Initiators
+            current = splitted[1]
+            initiators[current] = splitted[-1]
+        elif current is not None and len(splitted) == 1:
+            # The initiators list continues on the next lines
+            initiators[current] += splitted[-1]
+    for igroup, text in initiators.items():
+        ret[igroup] = set(i for i in text.split(',') if i and i != '-')
     return ret
 
 
-def cleanup(client, vserver, ovirt_url, ovirt_user, ovirt_ca, ovirt_pass):
-    clusters = ovirt_utils.get_vm_clusters(ovirt_url, ovirt_user, ovirt_ca, ovirt_pass)
+class OntapSnapshot(object):
+    """ The LUNs, mappings and igroups of a vserver, fetched once per session
+
+    Changes made by this tool are applied to the snapshot as well, so it
+    can keep answering queries without asking the server again.
+    """
+
+    def __init__(self, vserver, luns, lun_ids, igroups):
+        self.vserver = vserver
+        self.luns = dict((lun['name'], lun['volume']) for lun in luns)
+        self.lun_ids = lun_ids
+        self.igroups = igroups
+
+    @classmethod
+    def load(cls, client, vserver, echo=False):
+        """ Fetch the vserver state, running the three listings concurrently """
+        commands = ["lun show -vserver {0}".format(vserver),
+                    "mapping show -vserver {0}".format(vserver),
+                    "igroup show -vserver {0}".format(vserver)]
+        started = [_start_command(client, command) for command in commands]
+        try:
+            # parse the listings line by line while they're still arriving
+            outputs = [iter_output_lines(stdout, echo) for stdout, stderr in started]
+            return cls(vserver,
+                       parse_lun_show(outputs[0], vserver),
+                       parse_mapping_show(outputs[1], vserver),
+                       parse_igroup_show(outputs[2], vserver))
+        finally:
+            for stdout, stderr in started:
+                stdout.channel.close()
+
+    def has_lun(self, lun_name):
+        return lun_name in self.luns
+
+    def has_igroup(self, igroup_name):
+        return igroup_name in self.igroups
+
+    def initiators(self, igroup_name):
+        return set(self.igroups.get(igroup_name, ()))
+
+    def lun_id(self, lun_name):
+        if lun_name not in self.lun_ids:
+            raise Exception("Could not find LUN ID number")
+        return self.lun_ids[lun_name]
+
+
+def get_luns(client, vserver, echo=False):
+    """ Get a list of LUNs from the NetApp server """
+    with closing(stream_command(client, "lun show -vserver {0}".format(vserver), echo)) as lines:
+        return parse_lun_show(lines, vserver)
+
+
+class SSHBackend(object):
+    """ Drives the ONTAP CLI over SSH
+
+    This is the reference for the backend interface used by main(),
+    ontap_rest.RestBackend implements the same methods over ONTAP's HTTP API.
+    """
+
+    def __init__(self, server, username, vserver):
+        # imported here so the module stays cheap to import (e.g. for provisiond clients)
+        import paramiko
+        self.vserver = vserver
+        self.client = paramiko.SSHClient()
+        self.client.load_system_host_keys()
+        self.client.set_missing_host_key_policy(paramiko.WarningPolicy())
+        self.client.connect(server, username=username)
+        exec_command(self.client, "rows 0")  # For easier output parsing
+
+    def close(self):
+        self.client.close()
+
+    def load_snapshot(self):
+        return OntapSnapshot.load(self.client, self.vserver)
+
+    def get_luns(self):
+        return get_luns(self.client, self.vserver)
+
+    def create_lun(self, volume, lun_name, size, snapshot=None):
+        create_lun(self.client, volume, self.vserver, lun_name, size, snapshot)
+
+    def create_igroup(self, igroup_name, initator_list, snapshot=None):
+        create_igroup(self.client, self.vserver, igroup_name, initator_list, snapshot)
+
+    def add_initiators(self, igroup_name, initator_list, snapshot=None):
+        add_initiators(self.client, self.vserver, igroup_name, initator_list, snapshot)
+
+    def map_lun(self, volume, lun_name, igroup_name, snapshot=None):
+        return map_lun(self.client, self.vserver, volume, lun_name, igroup_name, snapshot)
+
+    def map_luns(self, mappings, snapshot):
+        """ Map (volume, lun name, igroup name)s, then learn all their ids from a single listing
+
+        Returns {lun name: error} for the mappings that failed.
+        """
+        errors = {}
+        for volume, lun_name, igroup_name in mappings:
+            try:
+                _mapping("create", self.client, self.vserver, volume, lun_name, igroup_name)
+            except Exception as e:
+                errors[lun_name] = str(e)
+        if len(errors) < len(mappings):
+            refresh_lun_ids(self.client, self.vserver, snapshot)
+        return errors
+
+    def delete_lun_mapping(self, volume, lun_name, igroup_name):
+        delete_lun_mapping(self.client, self.vserver, volume, lun_name, igroup_name)
+
+    def delete_igroup(self, igroup_name):
+        delete_igroup(self.client, self.vserver, igroup_name)
+
+    def delete_lun(self, volume, lun_name):
+        delete_lun(self.client, volume, self.vserver, lun_name)
+
+
+def connect_backend(backend, server, username, vserver, password=None, ca_file=None):
+    """ Connect an "ssh" or "rest" backend, the password is only used by the rest backend """
+    if backend == "rest":
+        # only needed (and imported) for the HTTP API
+        import ontap_rest
+        return ontap_rest.RestBackend(server, username, password, vserver, ca_file=ca_file)
+    return SSHBackend(server, username, vserver)
+
+
+def make_backend(args):
+    """ Connect the backend selected on the command line """
+    return connect_backend(args.backend, args.server, args.username, args.vserver,
+                           password=os.environ.get(args.password_env), ca_file=args.ca_file)
+
+
+def ensure_lun(backend, volume, lun_name, size, initiators):
+    """ Create & map a LUN (and its igroup) unless it exists, return the LUN id """
+    # First, check if it already exists:
+    snapshot = backend.load_snapshot()
+    if not snapshot.has_lun(lun_name):
+        # LUN doesn't exist, create it and map it
+        backend.create_lun(volume, lun_name, size, snapshot)
+        backend.create_igroup(lun_name, initiators, snapshot)
+        return backend.map_lun(volume, lun_name, lun_name, snapshot)
+
+    print("LUN alerady exists, checking igroup", file=sys.stderr)
+    # If the lun exists, we need to verify the igroup it's assigned to
+    # has all requested initiators.
+    # If it's missing initiators, that means we need to add them
+    # If it has initiators that don't belong, that means it might
+    # belong to another cluster, and that'll be an error
+    verify_igroup(backend, lun_name, initiators, snapshot)
+    return snapshot.lun_id(lun_name)
+
+
+def plan_cleanup(backend, ovirt_url, ovirt_user, ovirt_ca, ovirt_pass,
+                 token_cache_dir=ovirt_utils.DEFAULT_TOKEN_CACHE_DIR,
+                 clusters_cache_ttl=ovirt_utils.DEFAULT_CLUSTERS_CACHE_TTL):
+    """ List the LUNs that don't belong to any cluster on the ovirt """
+    luns = backend.get_luns()
+    # split to remove lun prfix from the search
+    prefixes = [lun['name'].split('-', 1)[1] for lun in luns]
+    clusters = ovirt_utils.get_vm_clusters(ovirt_url, ovirt_user, ovirt_ca, ovirt_pass,
+                                           token_cache_dir=token_cache_dir,
+                                           cache_ttl=clusters_cache_ttl, confirm=prefixes)
     print("Found {0} clusters".format(len(clusters)))
-    to_delete = []
-    for lun in get_luns(client, vserver):
-        # split to remove lun prfix from the search
-        if lun['name'].split('-', 1)[1] not in clusters:
-            to_delete.append(lun)
+    return [lun for lun, prefix in zip(luns, prefixes) if prefix not in clusters]
 
+
+def _delete_planned_lun(backend, lun):
+    """ Delete a single LUN of a cleanup plan, return its report entry """
+    steps = [("unmap", lambda: backend.delete_lun_mapping(lun['volume'], lun['name'], lun['name'])),
+             ("igroup delete", lambda: backend.delete_igroup(lun['name'])),
+             ("lun delete", lambda: backend.delete_lun(lun['volume'], lun['name']))]
+    for step, run_step in steps:
+        try:
+            run_step()
+        except Exception as e:
+            return {"name": lun['name'], "volume": lun['volume'], "ok": False,
+                    "step": step, "error": str(e)}
+    return {"name": lun['name'], "volume": lun['volume'], "ok": True}
+
+
+def run_cleanup_plan(backend, to_delete, workers=DEFAULT_CHANNELS):
+    """ Delete the LUNs of a cleanup plan, several LUNs at a time
+
+    Each LUN goes through unmap -> igroup delete -> lun delete in order;
+    a failing LUN doesn't stop the others. Returns the per-LUN report.
+    """
     print("Will delete {0} LUNs".format(len(to_delete)))
-    for lun in to_delete:
-        print("Deleting lun {0}".format(lun['name']))
-        delete_lun_mapping(client, vserver, lun['volume'], lun['name'], lun['name'])
-        delete_igroup(client, vserver, lun['name'])
-        delete_lun(client, lun['volume'], vserver, lun['name'])
+    pool = ThreadPool(max(1, min(workers, len(to_delete))))
+    try:
+        return pool.map(lambda lun: _delete_planned_lun(backend, lun), to_delete)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def print_cleanup_report(report):
+    """ Print the per-LUN result of a cleanup run, return the number of failures """
+    failed = 0
+    for entry in report:
+        if entry['ok']:
+            print("Deleted lun {0}".format(entry['name']))
+        else:
+            failed += 1
+            print("FAILED deleting lun {0} at '{1}': {2}".format(entry['name'], entry['step'],
+                                                                 entry['error']))
+    print("{0} LUNs deleted, {1} failed".format(len(report) - failed, failed))
+    return failed
+
+
+def load_manifest(path):
+    """ Load a desired-state manifest: a list of LUNs (or {"luns": [...]}) in YAML or JSON """
+    with open(path, "r") as f:
+        if path.endswith(".json"):
+            manifest = json.load(f)
+        else:
+            # only needed (and imported) for YAML manifests
+            import yaml
+            manifest = yaml.safe_load(f)
+    if isinstance(manifest, dict):
+        manifest = manifest.get("luns")
+    if not isinstance(manifest, list) or not manifest:
+        raise SystemExit("The manifest {0} has no list of LUNs".format(path))
+    for lun in manifest:
+        if not isinstance(lun, dict):
+            raise SystemExit("Invalid LUN entry {0!r} in the manifest".format(lun))
+        for key in ("name", "volume", "size", "initiators"):
+            if not lun.get(key):
+                raise SystemExit("LUN {0} is missing '{1}' in the manifest".format(lun.get("name"), key))
+        if not isinstance(lun["initiators"], list):
+            lun["initiators"] = "{0}".format(lun["initiators"]).split()
+        # YAML reads a bare 10 as a number, which is missing its unit anyway
+        lun["size"] = "{0}".format(lun["size"])
+        if not size_pattern.match(lun["size"]):
+            raise SystemExit("Invalid size {0} specified for {1}".format(lun["size"], lun["name"]))
+    return manifest
+
+
+def reconcile_lun(backend, snapshot, lun):
+    """ Bring a single LUN (but its mapping) to its desired state, return whether it needs mapping """
+    if not snapshot.has_lun(lun["name"]):
+        backend.create_lun(lun["volume"], lun["name"], lun["size"], snapshot)
+    if not snapshot.has_igroup(lun["name"]):
+        backend.create_igroup(lun["name"], lun["initiators"], snapshot)
+    else:
+        verify_igroup(backend, lun["name"], lun["initiators"], snapshot)
+    return lun["name"] not in snapshot.lun_ids
+
+
+def reconcile(backend, manifest):
+    """ Bring all the LUNs of a manifest to their desired state
+
+    The server state is read once, and only the missing pieces (LUN,
+    igroup, initiators, mapping) are created. The mappings come last, in
+    one batch, so the ids the server picks are learnt in a single pass.
+    Returns ({name: lun id}, {name: error}).
+    """
+    snapshot = backend.load_snapshot()
+    errors = {}
+    to_map = []
+    for lun in manifest:
+        try:
+            if reconcile_lun(backend, snapshot, lun):
+                to_map.append((lun["volume"], lun["name"], lun["name"]))
+        except Exception as e:
+            errors[lun["name"]] = str(e)
+    if to_map:
+        errors.update(backend.map_luns(to_map, snapshot))
+    lun_ids = {}
+    for lun in manifest:
+        if lun["name"] in errors:
+            continue
+        try:
+            lun_ids[lun["name"]] = snapshot.lun_id(lun["name"])
+        except Exception as e:
+            errors[lun["name"]] = str(e)
+    for name, error in sorted(errors.items()):
+        print("Failed reconciling lun {0}: {1}".format(name, error), file=sys.stderr)
+    return lun_ids, errors
 
 
 def main():
+    # cheap, lun_manager is imported by provisiond only once it's running
+    import provisiond
     parser = argparse.ArgumentParser(description='Manage LUNs, mappings and igroups on a NetApp cluster')
 
     # netapp parameters
     parser.add_argument('--server', nargs='?', type=str, help="NetApp server address", required=True)
     parser.add_argument('--username', nargs='?', type=str, help="Username for the NetApp cluster", required=True)
-    parser.add_argument('--action', nargs='?', choices=["create", "delete", "clean"], default="create")
+    parser.add_argument('--backend', nargs='?', choices=["ssh", "rest"], default="ssh",
+                        help="Drive the NetApp over the CLI (ssh) or ONTAP's HTTP API (rest)")
+    parser.add_argument('--password-env', nargs='?', type=str, default=DEFAULT_NETAPP_PASS_ENV_VAR,
+                        help="Env variable holding the NetApp password, for the rest backend")
+    parser.add_argument('--ca-file', nargs='?', type=str,
+                        help="CA bundle to verify the NetApp certificate with, for the rest backend")
+    parser.add_argument('--action', nargs='?', choices=["create", "delete", "clean", "reconcile"], default="create")
     parser.add_argument('--name', nargs='?', type=str, help="LUN name")
     parser.add_argument('--volume', nargs='?', type=str)
     parser.add_argument('--vserver', nargs='?', type=str, help="vserver for the LUN")
     parser.add_argument('--size', nargs='?', type=str, help="LUN Size")
     parser.add_argument('--initiators', nargs='?', type=str, help="List of initiators for the lun igroup")
 
+    # reconcile parameters
+    parser.add_argument('--manifest', nargs='?', type=str,
+                        help="YAML/JSON list of desired LUNs (name, volume, size, initiators)")
+
+    # cleanup parameters
+    parser.add_argument('--plan-file', nargs='?', type=str,
+                        help="Write the list of LUNs the cleanup will delete to this JSON file")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Only plan the cleanup, don't delete anything")
+    parser.add_argument('--workers', nargs='?', type=int, default=DEFAULT_CHANNELS,
+                        help="Number of LUNs deleted at the same time by the cleanup")
+
     # ovirt parameters, only required for "cleanup" mode
     ovirt_utils.add_ovirt_args(parser)
 
+    parser.add_argument('--daemon-socket', nargs='?', type=str,
+                        default=os.environ.get(provisiond.SOCKET_ENV_VAR),
+                        help="Send create requests to the provisiond listening on this socket, when it runs "
+                        "(the other actions always run in process)")
+
     args = parser.parse_args()
     if args.action == "create":
         if not args.name or not args.volume or not args.vserver or not args.size or not args.initiators:
@@ -218,55 +603,66 @@ def main():
     elif args.action == "delete":
         if not args.name or not args.volume or not args.vserver:
             raise SystemExit("name, volume and vserver are required for delete")
+    elif args.action == "reconcile":
+        if not args.manifest or not args.vserver:
+            raise SystemExit("manifest and vserver are required for reconcile")
+        manifest = load_manifest(args.manifest)
     elif args.action == "clean":
         if not args.ovirt_url or not args.ovirt_user or not args.ovirt_ca_pem_file:
             raise SystemExit("missing ovirt arguments")
         if args.ovirt_pass not in os.environ:
             raise SystemExit("missing ovirt password env var")
+    if args.backend == "rest" and args.password_env not in os.environ:
+        raise SystemExit("missing NetApp password env var {0}".format(args.password_env))
+
+    # only create goes through provisiond, see provisiond.SOCKET_ENV_VAR for why
+    sock = provisiond.connect(args.daemon_socket) if args.action == "create" else None
+    if sock is not None:
+        # provisiond keeps the NetApp session open between runs
+        netapp = {"backend": args.backend, "server": args.server, "username": args.username,
+                  "vserver": args.vserver, "password": os.environ.get(args.password_env),
+                  "ca_file": args.ca_file}
+        with closing(sock):
+            print(provisiond.request(sock, "lun_create", netapp=netapp, volume=args.volume,
+                                     name=args.name, size=args.size, initiators=args.initiators.split()))
+        print("Done!", file=sys.stderr)
+        return
 
-    client = SSHClient()
-    client.load_system_host_keys()
-    client.set_missing_host_key_policy(paramiko.WarningPolicy())
-
+    backend = make_backend(args)
     try:
-        client.connect(args.server, username=args.username)
-        exec_command(client, "rows 0")  # For easier output parsing
-
         if args.action == "create":
-            # Creating a new LUN
-            # First, check if it already exists:
-            already_exists = False
-            for lun in get_luns(client, args.vserver):
-                if lun['name'] == args.name:
-                    already_exists = True
-                    break
-            if not already_exists:
-                # LUN doesn't exist, create it and map it
-                create_lun(client, args.volume, args.vserver, args.name, args.size)
-                create_igroup(client, args.vserver, args.name, args.initiators.split())
-                map_lun(client, args.vserver, args.volume, args.name, args.name)
-            else:
-                print("LUN alerady exists, checking igroup", file=sys.stderr)
-                # If the lun exists, we need to verify the igroup it's assigned to
-                # has all requested initiators.
-                # If it's missing initiators, that means we need to add them
-                # If it has initiators that don't belong, that means it might
-                # belong to another cluster, and that'll be an error
-                verify_igroup(client, args.vserver, args.name, args.initiators.split())
-                print(find_lun_id(client, args.name))
+            # Creating a new LUN, print its id so the deployer can put it in the PV file
+            print(ensure_lun(backend, args.volume, args.name, args.size, args.initiators.split()))
 
         elif args.action == "delete":
             # Deleting a LUN
-            delete_lun_mapping(client, args.vserver, args.volume, args.name, args.name)
-            delete_igroup(client, args.vserver, args.name)
-            delete_lun(client, args.volume, args.vserver, args.name)
+            backend.delete_lun_mapping(args.volume, args.name, args.name)
+            backend.delete_igroup(args.name)
+            backend.delete_lun(args.volume, args.name)
+        elif args.action == "reconcile":
+            lun_ids, errors = reconcile(backend, manifest)
+            print(json.dumps(lun_ids, indent=1, sort_keys=True))
+            if errors:
+                raise SystemExit("{0} LUNs could not be reconciled".format(len(errors)))
         elif args.action == "clean":
-            cleanup(client, args.vserver, args.ovirt_url, args.ovirt_user,
-                    args.ovirt_ca_pem_file, os.environ[args.ovirt_pass])
+            to_delete = plan_cleanup(backend, args.ovirt_url, args.ovirt_user,
+                                     args.ovirt_ca_pem_file, os.environ[args.ovirt_pass],
+                                     token_cache_dir=args.ovirt_token_cache,
+                                     clusters_cache_ttl=args.ovirt_clusters_cache_ttl)
+            if args.plan_file:
+                with open(args.plan_file, "w") as f:
+                    json.dump(to_delete, f, indent=1)
+            if args.dry_run:
+                for lun in to_delete:
+                    print("Would delete lun {0} (volume {1})".format(lun['name'], lun['volume']))
+            else:
+                report = run_cleanup_plan(backend, to_delete, args.workers)
+                if print_cleanup_report(report):
+                    raise SystemExit("Some LUNs could not be deleted")
 
         print("Done!", file=sys.stderr)
     finally:
-        client.close()
+        backend.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# nfs_reclaim.py - Remove the NFS exports of clusters that are gone from the ovirt
+#
+# Copyright © 2018 Red Hat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import argparse
+import json
+import os
+import shutil
+from multiprocessing.pool import ThreadPool
+import ovirt_utils
+try:
+    from os import scandir
+except ImportError:
+    # python2, from the scandir package
+    from scandir import scandir
+
+# CONSTANTS
+
+# Trees measured / removed at the same time
+DEFAULT_WORKERS = 8
+SIZE_UNITS = ["B", "KiB", "MiB", "GiB", "TiB"]
+
+
+def format_size(size):
+    for unit in SIZE_UNITS:
+        if size < 1024 or unit == SIZE_UNITS[-1]:
+            return "{0:.1f}{1}".format(size, unit)
+        size /= 1024.0
+
+
+def scan_export_root(export_root):
+    """ Yield the (name, path) of the cluster directories under the export root """
+    for entry in scandir(export_root):
+        if entry.name.startswith(".") or not entry.is_dir(follow_symlinks=False):
+            continue
+        yield entry.name, entry.path
+
+
+def tree_size(path):
+    """ Total size of the files under path, symlinks are not followed """
+    size = 0
+    dirs = [path]
+    while dirs:
+        for entry in scandir(dirs.pop()):
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.path)
+            else:
+                size += entry.stat(follow_symlinks=False).st_size
+    return size
+
+
+def _run_on_pool(func, items, workers):
+    pool = ThreadPool(max(1, min(workers, len(items))))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def plan_reclaim(export_root, clusters, keep=(), measure=False, workers=DEFAULT_WORKERS):
+    """ List the export directories that don't belong to any live cluster
+
+    With `measure`, the size of every tree is computed (concurrently) for
+    the report, otherwise it's None.
+    """
+    to_delete = [{"name": name, "path": path, "size": None}
+                 for name, path in sorted(scan_export_root(export_root))
+                 if name not in clusters and name not in keep]
+    if measure:
+        sizes = _run_on_pool(lambda entry: tree_size(entry["path"]), to_delete, workers)
+        for entry, size in zip(to_delete, sizes):
+            entry["size"] = size
+    return to_delete
+
+
+def _reclaim_tree(entry):
+    """ Remove a single tree of a reclaim plan, return its report entry """
+    try:
+        shutil.rmtree(entry["path"])
+    except (IOError, OSError) as e:
+        return dict(entry, ok=False, error=str(e))
+    return dict(entry, ok=True)
+
+
+def run_reclaim_plan(to_delete, workers=DEFAULT_WORKERS):
+    """ Remove the trees of a reclaim plan, several trees at a time
+
+    A failing tree doesn't stop the others. Returns the per-tree report.
+    """
+    print("Will delete {0} export trees".format(len(to_delete)))
+    return _run_on_pool(_reclaim_tree, to_delete, workers)
+
+
+def print_plan(to_delete):
+    total = 0
+    for entry in to_delete:
+        if entry["size"] is None:
+            print("Would delete {0}".format(entry["path"]))
+        else:
+            total += entry["size"]
+            print("Would delete {0} ({1})".format(entry["path"], format_size(entry["size"])))
+    if any(entry["size"] is not None for entry in to_delete):
+        print("{0} would be reclaimed".format(format_size(total)))
+
+
+def print_reclaim_report(report):
+    """ Print the per-tree result of a reclaim run, return the number of failures """
+    failed = 0
+    reclaimed = 0
+    for entry in report:
+        if entry["ok"]:
+            print("Deleted {0}".format(entry["path"]))
+            reclaimed += entry["size"] or 0
+        else:
+            failed += 1
+            print("FAILED deleting {0}: {1}".format(entry["path"], entry["error"]))
+    print("{0} export trees deleted, {1} failed".format(len(report) - failed, failed))
+    if any(entry["size"] is not None for entry in report):
+        print("{0} reclaimed".format(format_size(reclaimed)))
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove the NFS exports of clusters that are gone from the ovirt')
+    parser.add_argument('--export-root', nargs='?', type=str, required=True,
+                        help="Directory holding a directory per cluster (e.g. the mounted NFS export)")
+    parser.add_argument('--clusters', nargs='?', type=str,
+                        help="Space separated live clusters, instead of asking the ovirt")
+    parser.add_argument('--keep', nargs='?', type=str, default="",
+                        help="Space separated directories to keep even if no cluster uses them")
+    parser.add_argument('--plan-file', nargs='?', type=str,
+                        help="Write the list of trees the reclaim will delete to this JSON file")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Only plan the reclaim, don't delete anything")
+    parser.add_argument('--size-report', action='store_true',
+                        help="Measure the trees to report the reclaimed space")
+    parser.add_argument('--workers', nargs='?', type=int, default=DEFAULT_WORKERS,
+                        help="Number of trees measured / deleted at the same time")
+
+    # ovirt parameters, not needed with --clusters
+    ovirt_utils.add_ovirt_args(parser)
+
+    args = parser.parse_args()
+    if not os.path.isdir(args.export_root):
+        raise SystemExit("{0} is not a directory".format(args.export_root))
+
+    if args.clusters is not None:
+        clusters = set(args.clusters.split())
+    else:
+        if not args.ovirt_url or not args.ovirt_user or not args.ovirt_ca_pem_file:
+            raise SystemExit("missing ovirt arguments")
+        if args.ovirt_pass not in os.environ:
+            raise SystemExit("missing ovirt password env var")
+        # never from the cache: a cluster created meanwhile would lose its exports
+        # and every export without VMs in the scan is looked up again by name
+        clusters = ovirt_utils.get_vm_clusters(args.ovirt_url, args.ovirt_user,
+                                               args.ovirt_ca_pem_file, os.environ[args.ovirt_pass],
+                                               token_cache_dir=args.ovirt_token_cache,
+                                               cache_ttl=0,
+                                               confirm=[name for name, _ in scan_export_root(args.export_root)])
+    print("Found {0} clusters".format(len(clusters)))
+    if not clusters:
+        # most likely a wrong engine, not an empty one
+        raise SystemExit("No live clusters, refusing to reclaim every export")
+
+    to_delete = plan_reclaim(args.export_root, clusters, set(args.keep.split()),
+                             args.size_report, args.workers)
+    if args.plan_file:
+        with open(args.plan_file, "w") as f:
+            json.dump(to_delete, f, indent=1)
+    if args.dry_run:
+        print_plan(to_delete)
+    else:
+        report = run_reclaim_plan(to_delete, args.workers)
+        if print_reclaim_report(report):
+            raise SystemExit("Some export trees could not be deleted")
+
+
+if __name__ == "__main__":
+    main()
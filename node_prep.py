@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# node_prep.py - Prepare the cluster nodes for iSCSI and create their LUN
+#
+# Copyright © 2018 Red Hat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import argparse
+import os
+import sys
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+import lun_manager
+
+# CONSTANTS
+
+DEFAULT_ROOT_PASS_ENV_VAR = "ROOT_PASSWORD"
+# Nodes prepared at the same time
+DEFAULT_WORKERS = 16
+INITIATOR_PREFIX = "iqn.1994-05.com.redhat"
+SET_INITIATOR_COMMAND = ("echo InitiatorName={iname} > /etc/iscsi/initiatorname.iscsi; "
+                         "systemctl restart iscsi.service")
+
+NodeResult = namedtuple("NodeResult", ["node", "address", "initiator", "out", "error"])
+
+
+def ssh_connect(address, password, username="root"):
+    """ Open an SSH session to a node """
+    # imported here so the module stays cheap to import
+    import paramiko
+    client = paramiko.SSHClient()
+    client.load_system_host_keys()
+    client.set_missing_host_key_policy(paramiko.WarningPolicy())
+    client.connect(address, username=username, password=password)
+    return client
+
+
+def run_command(client, command, stdin_data=None):
+    """ Run a (shell) command on a node, return its output, raise if it fails """
+    stdin, stdout, stderr = client.exec_command(command)
+    if stdin_data is not None:
+        stdin.write(stdin_data)
+        stdin.channel.shutdown_write()
+    out = stdout.read().strip()
+    err = stderr.read().strip()
+    status = stdout.channel.recv_exit_status()
+    if status != 0:
+        raise Exception("'{0}' failed ({1}): {2}".format(command, status, err or out))
+    return out
+
+
+def cluster_nodes(name_prefix, master, infra, compute):
+    """ Return the (node name, address) of all the nodes of a cluster """
+    nodes = [("{0}-master001".format(name_prefix), master)]
+    for node_type, addresses in (("infra", infra), ("compute", compute)):
+        for i, address in enumerate(addresses, 1):
+            nodes.append(("{0}-{1}{2:03d}".format(name_prefix, node_type, i), address))
+    return nodes
+
+
+def initiator_name(node):
+    return "{0}:{1}".format(INITIATOR_PREFIX, node)
+
+
+def prepare_node(node, address, password):
+    """ Set the iSCSI initiator name of a node, never raises """
+    iname = initiator_name(node)
+    try:
+        client = ssh_connect(address, password)
+        try:
+            out = run_command(client, SET_INITIATOR_COMMAND.format(iname=iname))
+        finally:
+            client.close()
+        return NodeResult(node, address, iname, out, None)
+    except Exception as e:
+        return NodeResult(node, address, iname, None, "{0}".format(e))
+
+
+def prepare_nodes(nodes, password, workers=DEFAULT_WORKERS):
+    """ Prepare all the nodes concurrently, return their results in the order of `nodes` """
+    pool = ThreadPool(max(1, min(workers, len(nodes))))
+    try:
+        return pool.map(lambda node: prepare_node(node[0], node[1], password), nodes)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Set the iSCSI initiator names of the cluster nodes '
+                                                 'and create their LUN')
+    parser.add_argument('--name-prefix', nargs='?', type=str, required=True)
+    parser.add_argument('--master-host', nargs='?', type=str, required=True)
+    parser.add_argument('--infra-ips', nargs='?', type=str, default="")
+    parser.add_argument('--compute-ips', nargs='?', type=str, default="")
+    parser.add_argument('--root-password-env', nargs='?', type=str, default=DEFAULT_ROOT_PASS_ENV_VAR,
+                        help="Env variable holding the nodes root password")
+    parser.add_argument('--workers', nargs='?', type=int, default=DEFAULT_WORKERS,
+                        help="Number of nodes prepared at the same time")
+
+    # netapp parameters, the LUN is created when the server is set
+    parser.add_argument('--netapp-server', nargs='?', type=str)
+    parser.add_argument('--netapp-username', nargs='?', type=str)
+    parser.add_argument('--netapp-backend', nargs='?', choices=["ssh", "rest"], default="ssh")
+    parser.add_argument('--netapp-password-env', nargs='?', type=str,
+                        default=lun_manager.DEFAULT_NETAPP_PASS_ENV_VAR)
+    parser.add_argument('--netapp-ca-file', nargs='?', type=str)
+    parser.add_argument('--volume', nargs='?', type=str)
+    parser.add_argument('--vserver', nargs='?', type=str)
+    parser.add_argument('--lun-name', nargs='?', type=str, help="Defaults to cm-<name prefix>")
+    parser.add_argument('--size', nargs='?', type=str, help="LUN Size")
+    args = parser.parse_args()
+
+    if args.root_password_env not in os.environ:
+        raise SystemExit("missing root password env var {0}".format(args.root_password_env))
+    if args.netapp_server:
+        if not args.netapp_username or not args.volume or not args.vserver or not args.size:
+            raise SystemExit("netapp-username, volume, vserver and size are required to create the LUN")
+        if not lun_manager.size_pattern.match(args.size):
+            raise SystemExit("Invalid size {0} specified".format(args.size))
+
+    nodes = cluster_nodes(args.name_prefix, args.master_host,
+                          args.infra_ips.split(), args.compute_ips.split())
+    print("Setting initiator names on {0} nodes...".format(len(nodes)), file=sys.stderr)
+    results = prepare_nodes(nodes, os.environ[args.root_password_env], args.workers)
+    failed = [result for result in results if result.error is not None]
+    for result in failed:
+        print("{0} ({1}): {2}".format(result.node, result.address, result.error), file=sys.stderr)
+    if failed:
+        raise SystemExit("{0} of {1} nodes could not be prepared".format(len(failed), len(nodes)))
+
+    initiators = [result.initiator for result in results]
+    print("Initiators: {0}".format(" ".join(initiators)), file=sys.stderr)
+    if not args.netapp_server:
+        return
+
+    print("Creating iscsi LUN...", file=sys.stderr)
+    backend = lun_manager.connect_backend(args.netapp_backend, args.netapp_server, args.netapp_username,
+                                          args.vserver, password=os.environ.get(args.netapp_password_env),
+                                          ca_file=args.netapp_ca_file)
+    try:
+        # print the LUN id so the deployer can put it in the PV file
+        print(lun_manager.ensure_lun(backend, args.volume, args.lun_name or "cm-{0}".format(args.name_prefix),
+                                     args.size, initiators))
+    finally:
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
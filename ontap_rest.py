@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# ontap_rest.py - lun_manager backend using the ONTAP HTTP (REST) API
+#
+# Copyright © 2018 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals, print_function
+import base64
+import json
+import re
+import ssl
+import threading
+import lun_manager
+try:
+    import http.client as httplib
+    from urllib.parse import urlencode, urlsplit
+except ImportError:
+    import httplib
+    from urllib import urlencode
+    from urlparse import urlsplit
+
+# CONSTANTS
+
+# Records requested per page on listings
+PAGE_SIZE = 1000
+LUNS_PATH = "/api/storage/luns"
+IGROUPS_PATH = "/api/protocols/san/igroups"
+LUN_MAPS_PATH = "/api/protocols/san/lun-maps"
+# Requests that are safe to send again when the connection breaks
+IDEMPOTENT_METHODS = ("GET", "DELETE")
+
+SIZE_UNITS = {"": 0, "k": 1, "m": 2, "g": 3}
+size_parts_pattern = re.compile("^(\\d+(?:\\.\\d)?)([kmg]?)b$", re.I)
+
+
+def size_to_bytes(size):
+    """ Convert a lun_manager size (e.g. 15gb) to bytes """
+    match = size_parts_pattern.match(size)
+    if match is None:
+        raise ValueError("Invalid size {0}".format(size))
+    return int(float(match.group(1)) * 1024 ** SIZE_UNITS[match.group(2).lower()])
+
+
+def lun_path(volume, lun_name):
+    return "/vol/{0}/{1}".format(volume, lun_name)
+
+
+class RestBackend(object):
+    """ Drives ONTAP over its HTTP API, see lun_manager.SSHBackend for the interface
+
+    Listings are fetched page by page with only the fields we need, and
+    every thread reuses its own keep-alive HTTP connection.
+    """
+
+    def __init__(self, server, username, password, vserver, ca_file=None):
+        if "://" not in server:
+            server = "https://{0}".format(server)
+        url = urlsplit(server)
+        self.scheme = url.scheme
+        self.netloc = url.netloc
+        self.vserver = vserver
+        self.ssl_context = None
+        if self.scheme == "https":
+            self.ssl_context = ssl.create_default_context(cafile=ca_file)
+        credentials = "{0}:{1}".format(username, password).encode("utf-8")
+        self.headers = {"Accept": "application/json",
+                        "Content-Type": "application/json",
+                        "Authorization": "Basic " + base64.b64encode(credentials).decode("ascii")}
+        self.local = threading.local()
+        self.connections = []
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+
+    def _connection(self):
+        """ The keep-alive connection of the current thread """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            if self.scheme == "https":
+                connection = httplib.HTTPSConnection(self.netloc, context=self.ssl_context)
+            else:
+                connection = httplib.HTTPConnection(self.netloc)
+            self.local.connection = connection
+            self.connections.append(connection)
+        return connection
+
+    def _request(self, method, path, params=None, json_body=None):
+        if params:
+            path += ("&" if "?" in path else "?") + urlencode(params)
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body)
+        connection = self._connection()
+        try:
+            connection.request(method, path, body=body, headers=self.headers)
+            response = connection.getresponse()
+        except (httplib.HTTPException, IOError):
+            connection.close()
+            if method not in IDEMPOTENT_METHODS:
+                # the server may have done the work before the connection
+                # broke, sending it again could create duplicates
+                raise
+            # the server may have closed the idle connection, retry once on a new one
+            connection.request(method, path, body=body, headers=self.headers)
+            response = connection.getresponse()
+        data = response.read()
+        if response.status >= 400:
+            try:
+                message = json.loads(data.decode("utf-8"))["error"]["message"]
+            except (ValueError, KeyError, TypeError):
+                message = data
+            raise Exception("{0} {1} failed ({2}): {3}".format(method, path, response.status, message))
+        if data:
+            return json.loads(data.decode("utf-8"))
+        return {}
+
+    def _get_all(self, path, fields, **filters):
+        """ Yield all the records of a listing, following the pagination links """
+        params = {"svm.name": self.vserver, "fields": fields, "max_records": PAGE_SIZE}
+        params.update(filters)
+        while path:
+            body = self._request("GET", path, params=params)
+            for record in body.get("records", []):
+                yield record
+            # the next link carries the query, including the paging position
+            path = body.get("_links", {}).get("next", {}).get("href")
+            params = None
+
+    def _uuid(self, path, name, **filters):
+        for record in self._get_all(path, "uuid", name=name, **filters):
+            return record["uuid"]
+        raise Exception("{0} not found".format(name))
+
+    def load_snapshot(self):
+        luns = self.get_luns()
+        lun_ids = {}
+        for mapping in self._get_all(LUN_MAPS_PATH, "lun.name,logical_unit_number"):
+            lun_ids[mapping["lun"]["name"].split("/")[-1]] = str(mapping["logical_unit_number"])
+        igroups = {}
+        for igroup in self._get_all(IGROUPS_PATH, "name,initiators.name"):
+            igroups[igroup["name"]] = set(i["name"] for i in igroup.get("initiators", []))
+        return lun_manager.OntapSnapshot(self.vserver, luns, lun_ids, igroups)
+
+    def get_luns(self):
+        ret = []
+        for lun in self._get_all(LUNS_PATH, "name"):
+            path = lun["name"].split("/")
+            ret.append({"volume": path[2], "name": path[3]})
+        return ret
+
+    def create_lun(self, volume, lun_name, size, snapshot=None):
+        self._request("POST", LUNS_PATH, json_body={"svm": {"name": self.vserver},
+                                                    "name": lun_path(volume, lun_name),
+                                                    "os_type": "linux",
+                                                    "space": {"size": size_to_bytes(size)}})
+        if snapshot is not None:
+            snapshot.luns[lun_name] = volume
+
+    def create_igroup(self, igroup_name, initator_list, snapshot=None):
+        self._request("POST", IGROUPS_PATH, json_body={"svm": {"name": self.vserver},
+                                                       "name": igroup_name,
+                                                       "protocol": "iscsi",
+                                                       "os_type": "linux",
+                                                       "initiators": [{"name": i} for i in initator_list]})
+        if snapshot is not None:
+            snapshot.igroups[igroup_name] = set(initator_list)
+
+    def add_initiators(self, igroup_name, initator_list, snapshot=None):
+        uuid = self._uuid(IGROUPS_PATH, igroup_name)
+        self._request("POST", "{0}/{1}/initiators".format(IGROUPS_PATH, uuid),
+                      json_body={"records": [{"name": i} for i in initator_list]})
+        if snapshot is not None:
+            snapshot.igroups[igroup_name] = snapshot.initiators(igroup_name) | set(initator_list)
+
+    def map_lun(self, volume, lun_name, igroup_name, snapshot=None):
+        body = self._request("POST", LUN_MAPS_PATH, params={"return_records": "true"},
+                             json_body={"svm": {"name": self.vserver},
+                                        "lun": {"name": lun_path(volume, lun_name)},
+                                        "igroup": {"name": igroup_name}})
+        records = body.get("records", [])
+        if records and "logical_unit_number" in records[0]:
+            lun_id = str(records[0]["logical_unit_number"])
+        else:
+            lun_id = None
+            for mapping in self._get_all(LUN_MAPS_PATH, "logical_unit_number",
+                                         **{"lun.name": lun_path(volume, lun_name),
+                                            "igroup.name": igroup_name}):
+                lun_id = str(mapping["logical_unit_number"])
+            if lun_id is None:
+                raise Exception("Could not find LUN ID number")
+        if snapshot is not None:
+            snapshot.lun_ids[lun_name] = lun_id
+        return lun_id
+
+    def map_luns(self, mappings, snapshot):
+        """ Map (volume, lun name, igroup name)s, return {lun name: error} for the failed ones
+
+        The ids come back with every mapping, no listing is needed.
+        """
+        errors = {}
+        for volume, lun_name, igroup_name in mappings:
+            try:
+                self.map_lun(volume, lun_name, igroup_name, snapshot)
+            except Exception as e:
+                errors[lun_name] = str(e)
+        return errors
+
+    def delete_lun_mapping(self, volume, lun_name, igroup_name):
+        for mapping in self._get_all(LUN_MAPS_PATH, "lun.uuid,igroup.uuid",
+                                     **{"lun.name": lun_path(volume, lun_name),
+                                        "igroup.name": igroup_name}):
+            self._request("DELETE", "{0}/{1}/{2}".format(LUN_MAPS_PATH, mapping["lun"]["uuid"],
+                                                         mapping["igroup"]["uuid"]))
+            return
+        raise Exception("mapping delete failed")
+
+    def delete_igroup(self, igroup_name):
+        self._request("DELETE", "{0}/{1}".format(IGROUPS_PATH, self._uuid(IGROUPS_PATH, igroup_name)))
+
+    def delete_lun(self, volume, lun_name):
+        uuid = self._uuid(LUNS_PATH, lun_path(volume, lun_name))
+        self._request("DELETE", "{0}/{1}".format(LUNS_PATH, uuid))
@@ -17,14 +17,28 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function, unicode_literals
-import ovirtsdk4
+import contextlib
+import hashlib
+import json
+import os
+import time
 import re
+import tempfile
 
 # CONSTANTS
 
 DEFAULT_OVIRT_PASS_ENV_VAR = "OV_PASS"
 CLUSTER_PATTERN = re.compile("^(.*)-(?:infra|compute|master)[0-9]+")
 POOL_PATTERN = re.compile("^(.*)-[0-9]+")
+DEFAULT_TOKEN_CACHE_DIR = os.path.expanduser("~/.cache/ocp-ansible-jenkins")
+# The engine drops SSO sessions after 30 minutes without activity by default
+DEFAULT_TOKEN_TTL = 1800
+# How long the list of clusters found on the engine is reused, off by
+# default: the list decides which storage gets deleted, and a cluster
+# created from another machine within the TTL would look dead
+DEFAULT_CLUSTERS_CACHE_TTL = 0
+# Number of VMs fetched per request when scanning the whole engine
+VMS_PAGE_SIZE = 200
 
 
 def add_ovirt_args(parser, required=False):
@@ -38,23 +52,198 @@ def add_ovirt_args(parser, required=False):
     parser.add_argument('--ovirt-pass', const=DEFAULT_OVIRT_PASS_ENV_VAR, nargs='?',
                         type=str, default=DEFAULT_OVIRT_PASS_ENV_VAR,
                         help='Env variables to use to get the password to authenticate to oVirt')
+    parser.add_argument('--ovirt-token-cache', nargs='?', type=str, default=DEFAULT_TOKEN_CACHE_DIR,
+                        help='Directory to cache the oVirt SSO token (and cluster list) in, empty to disable')
+    parser.add_argument('--ovirt-clusters-cache-ttl', nargs='?', type=int, default=DEFAULT_CLUSTERS_CACHE_TTL,
+                        help='Seconds to reuse the list of clusters found on oVirt (default 0, disabled). '
+                             'Clusters created from another machine meanwhile are seen as dead')
 
 
-def get_vm_clusters(ovirt_url, ovirt_user, ovirt_ca, ovirt_pass):
-    """ Get all openshift clusters on the ovirt """
-    ret = set()
+def _cache_file(cache_dir, kind, *key_parts):
+    """ Path of a cache file of a given kind, keyed by key_parts """
+    key = hashlib.sha1("|".join(key_parts).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, "ovirt-{0}-{1}.json".format(kind, key))
+
+
+def _write_cache_file(path, data):
+    """ Atomically write a JSON cache file, readable only by the current user """
+    cache_dir = os.path.dirname(path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # a temp file of our own, concurrent jobs may be writing the same cache file
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=os.path.basename(path) + ".")
     try:
-        connection = ovirtsdk4.Connection(url=ovirt_url, username=ovirt_user,
-                                          password=ovirt_pass, ca_file=ovirt_ca)
-        vms_service = connection.system_service().vms_service()
-        for vm in vms_service.list():
-            match = CLUSTER_PATTERN.match(vm.name)
-            pool_match = POOL_PATTERN.match(vm.name)
-            if match is not None:
-                ret.add(match.group(1))
-            elif pool_match is not None:
-                ret.add(pool_match.group(1))
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.rename(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _token_file(token_cache_dir, url, username):
+    """ Path of the cached token for a given engine & user """
+    return _cache_file(token_cache_dir, "token", url, username)
+
+
+def load_token(token_cache_dir, url, username):
+    """ Return the cached SSO token, or None if it's missing or expired """
+    try:
+        with open(_token_file(token_cache_dir, url, username), "r") as f:
+            cached = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if cached.get("expires", 0) <= time.time():
+        return None
+    return cached.get("token")
+
+
+def save_token(token_cache_dir, url, username, token, ttl=DEFAULT_TOKEN_TTL):
+    """ Cache an SSO token, readable only by the current user """
+    _write_cache_file(_token_file(token_cache_dir, url, username),
+                      {"token": token, "expires": time.time() + ttl})
+
+
+def drop_token(token_cache_dir, url, username):
+    """ Remove a cached token (e.g. after the engine rejected it) """
+    try:
+        os.remove(_token_file(token_cache_dir, url, username))
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def ovirt_connection(url, username, password, ca_file, token_cache_dir=DEFAULT_TOKEN_CACHE_DIR,
+                     token_ttl=DEFAULT_TOKEN_TTL, connections=1, **kwargs):
+    """ Open a connection to the engine, reusing a cached SSO token when possible
+
+    `connections` is the number of HTTP connections the SDK keeps open for
+    concurrent (wait=False) requests. Extra keyword arguments are passed
+    as is to ovirtsdk4.Connection.
+    """
+    # imported here so scripts that don't talk to the engine don't pay for the SDK
+    import ovirtsdk4
+    token = None
+    if token_cache_dir:
+        token = load_token(token_cache_dir, url, username)
+    connection = ovirtsdk4.Connection(url=url, username=username, password=password,
+                                      ca_file=ca_file, token=token,
+                                      connections=connections, **kwargs)
+    if token is not None and not connection.test():
+        # The engine doesn't know this token anymore, log in from scratch
+        connection.close(logout=False)
+        drop_token(token_cache_dir, url, username)
+        connection = ovirtsdk4.Connection(url=url, username=username, password=password,
+                                          ca_file=ca_file, connections=connections, **kwargs)
+    try:
+        yield connection
     finally:
-        if connection:
+        if token_cache_dir:
+            try:
+                save_token(token_cache_dir, url, username, connection.authenticate(), token_ttl)
+            except (ovirtsdk4.Error, IOError, OSError):
+                # failing to cache the token only costs a login next time
+                pass
+            # keep the SSO session alive for the next caller
+            connection.close(logout=False)
+        else:
             connection.close()
+
+
+def iter_vm_names(vms_service, page_size=VMS_PAGE_SIZE):
+    """ Yield the names of all the VMs on the engine, one page at a time """
+    page = 1
+    while True:
+        vms = vms_service.list(search="sortby name asc page {0}".format(page), max=page_size)
+        for vm in vms:
+            yield vm.name
+        if len(vms) < page_size:
+            return
+        page += 1
+
+
+def match_vm_cluster(vm_name):
+    """ Return the openshift cluster (name prefix) a VM belongs to, or None """
+    match = CLUSTER_PATTERN.match(vm_name)
+    if match is not None:
+        return match.group(1)
+    pool_match = POOL_PATTERN.match(vm_name)
+    if pool_match is not None:
+        return pool_match.group(1)
+    return None
+
+
+def _clusters_cache_file(cache_dir, ovirt_url):
+    """ Path of the cached cluster list of a given engine """
+    return _cache_file(cache_dir, "clusters", ovirt_url)
+
+
+def drop_vm_clusters_cache(ovirt_url, cache_dir=DEFAULT_TOKEN_CACHE_DIR):
+    """ Forget the cached cluster list (e.g. after creating a cluster) """
+    if not cache_dir:
+        return
+    try:
+        os.remove(_clusters_cache_file(cache_dir, ovirt_url))
+    except OSError:
+        pass
+
+
+def list_vm_clusters(vms_service):
+    """ List the openshift clusters (name prefixes) of the VMs on the engine """
+    ret = set()
+    for vm_name in iter_vm_names(vms_service):
+        cluster = match_vm_cluster(vm_name)
+        if cluster is not None:
+            ret.add(cluster)
     return ret
+
+
+def find_live_clusters(vms_service, prefixes):
+    """ Return the prefixes that still have VMs, with a name query for each
+
+    Unlike the paged scan, which skips VMs when others are created or
+    removed meanwhile, a query by name can't miss a cluster.
+    """
+    ret = set()
+    for prefix in prefixes:
+        vms = vms_service.list(search="name={0}-*".format(prefix))
+        if any(match_vm_cluster(vm.name) == prefix for vm in vms):
+            ret.add(prefix)
+    return ret
+
+
+def get_vm_clusters(ovirt_url, ovirt_user, ovirt_ca, ovirt_pass,
+                    token_cache_dir=DEFAULT_TOKEN_CACHE_DIR,
+                    cache_ttl=DEFAULT_CLUSTERS_CACHE_TTL, confirm=()):
+    """ Get all openshift clusters on the ovirt
+
+    `confirm` holds the prefixes the caller would treat as dead (e.g. the
+    ones its storage is named after): those missing from the scan (or the
+    cache) are looked up again by name before being left out.
+    """
+    ret = None
+    cache_file = None
+    if token_cache_dir and cache_ttl > 0:
+        cache_file = _clusters_cache_file(token_cache_dir, ovirt_url)
+        try:
+            with open(cache_file, "r") as f:
+                cached = json.load(f)
+            if cached.get("expires", 0) > time.time():
+                ret = set(cached["clusters"])
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+    if ret is not None and not set(confirm) - ret:
+        return ret
+
+    with ovirt_connection(ovirt_url, ovirt_user, ovirt_pass, ovirt_ca,
+                          token_cache_dir=token_cache_dir) as connection:
+        vms_service = connection.system_service().vms_service()
+        if ret is None:
+            ret = list_vm_clusters(vms_service)
+            if cache_file is not None:
+                try:
+                    _write_cache_file(cache_file, {"clusters": sorted(ret), "expires": time.time() + cache_ttl})
+                except (IOError, OSError):
+                    # failing to cache the list only costs a scan next time
+                    pass
+        return ret | find_live_clusters(vms_service, set(confirm) - ret)
@@ -1,14 +1,34 @@
 #!/bin/bash
+FACTS_ENV="${HOME}/cluster-facts.env"
+
+if [ -f "${FACTS_ENV}" ]; then
+    # Collected by the deployer (cluster_facts.py)
+    . "${FACTS_ENV}"
+else
+    # All the routes in a single call, as "namespace name host" lines
+    ROUTES="$(oc get route --all-namespaces -o go-template --template='{{range .items}}{{.metadata.namespace}} {{.metadata.name}} {{.spec.host}}{{"\n"}}{{end}}' 2> /dev/null)"
+    route_host () {
+        echo "${ROUTES}" | awk -v ns="${1}" -v name="${2}" '$1 == ns && $2 == name {print $3}'
+    }
+    OPENSHIFT_HAWKULAR_ROUTE="$(route_host openshift-infra hawkular-metrics)"
+    OPENSHIFT_PROMETHEUS_ALERTS_ROUTE="$(route_host openshift-metrics alerts)"
+    OPENSHIFT_PROMETHEUS_METRICS_ROUTE="$(route_host openshift-metrics prometheus)"
+    OPENSHIFT_CFME_ROUTE="$(route_host openshift-management httpd)"
+    OPENSHIFT_MASTER_HOST="$(oc get nodes -o name |grep master |sed -e 's/nodes\///g')"
+    OPENSHIFT_MANAGEMENT_ADMIN_TOKEN="$(oc sa get-token -n management-infra management-admin)"
+    OPENSHIFT_CA_CRT="$(cat /etc/origin/master/ca.crt)"
+fi
+
 echo
 echo "#----- Environment variables -----"
 echo
-echo export OPENSHIFT_HAWKULAR_ROUTE=\"$(oc get route --namespace='openshift-infra' -o go-template --template='{{.spec.host}}' hawkular-metrics 2> /dev/null)\"
-echo export OPENSHIFT_PROMETHEUS_ALERTS_ROUTE=\"$(oc get route --namespace='openshift-metrics' -o go-template --template='{{.spec.host}}' alerts 2> /dev/null)\"
-echo export OPENSHIFT_PROMETHEUS_METRICS_ROUTE=\"$(oc get route --namespace='openshift-metrics' -o go-template --template='{{.spec.host}}' prometheus 2> /dev/null)\"
-echo export OPENSHIFT_CFME_ROUTE=\"$(oc get route --namespace='openshift-management' -o go-template --template='{{.spec.host}}' httpd 2> /dev/null)\"
-echo export OPENSHIFT_MASTER_HOST=\"$(oc get nodes -o name |grep master |sed -e 's/nodes\///g')\"
-echo export OPENSHIFT_MANAGEMENT_ADMIN_TOKEN=\"$(oc sa get-token -n management-infra management-admin)\"
-echo export OPENSHIFT_CA_CRT=\""$(cat /etc/origin/master/ca.crt)"\"
+echo export OPENSHIFT_HAWKULAR_ROUTE=\"${OPENSHIFT_HAWKULAR_ROUTE}\"
+echo export OPENSHIFT_PROMETHEUS_ALERTS_ROUTE=\"${OPENSHIFT_PROMETHEUS_ALERTS_ROUTE}\"
+echo export OPENSHIFT_PROMETHEUS_METRICS_ROUTE=\"${OPENSHIFT_PROMETHEUS_METRICS_ROUTE}\"
+echo export OPENSHIFT_CFME_ROUTE=\"${OPENSHIFT_CFME_ROUTE}\"
+echo export OPENSHIFT_MASTER_HOST=\"${OPENSHIFT_MASTER_HOST}\"
+echo export OPENSHIFT_MANAGEMENT_ADMIN_TOKEN=\"${OPENSHIFT_MANAGEMENT_ADMIN_TOKEN}\"
+echo export OPENSHIFT_CA_CRT=\""${OPENSHIFT_CA_CRT}"\"
 echo
 echo "# Run this command to configure the provider in your local ManageIQ:"
 echo
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# provisiond.py - Resident provisioning service keeping sessions and templates warm
+#
+# Copyright © 2018 Red Hat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import argparse
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import create_inventory
+import lun_manager
+import ovirt_utils
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+# CONSTANTS
+
+# Clients (create_inventory.py, lun_manager.py) use the daemon when this is set
+#
+# Only the short, frequent steps go through the daemon: inventory rendering and
+# lun_manager --action create, where starting up and logging in cost more than
+# the work itself. cm_ovirt_vm_creator.py and lun_manager's delete, clean and
+# reconcile run for minutes against a whole cluster, so a process startup is
+# noise for them, and serving them here would mean keeping per-job oVirt
+# credentials and long jobs in the daemon. They stay standalone; their engine
+# logins are already reused between runs through the ovirt_utils token cache.
+SOCKET_ENV_VAR = "PROVISIOND_SOCKET"
+DEFAULT_SOCKET = os.path.join(ovirt_utils.DEFAULT_TOKEN_CACHE_DIR, "provisiond.sock")
+
+
+def connect(socket_path):
+    """ Connect to the daemon, return None when none listens on socket_path
+
+    A socket file left behind by a daemon that died counts as no daemon,
+    so the clients fall back to doing the work in process.
+    """
+    if not socket_path or not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error as e:
+        sock.close()
+        print("provisiond is not running on {0} ({1}), working in process".format(socket_path, e),
+              file=sys.stderr)
+        return None
+    return sock
+
+
+def request(sock, command, **params):
+    """ Send a request over a connection to the daemon and return its result
+
+    The protocol is one JSON object per line each way: the request holds the
+    command and its parameters, the response either "result" or "error".
+    A connection can carry any number of requests.
+    """
+    params["command"] = command
+    sock.sendall((json.dumps(params) + "\n").encode("utf-8"))
+    line = sock.makefile("rb").readline()
+    if not line:
+        raise SystemExit("provisiond closed the connection")
+    response = json.loads(line.decode("utf-8"))
+    if "error" in response:
+        raise SystemExit(response["error"])
+    return response["result"]
+
+
+def call(socket_path, command, **params):
+    """ Connect to the daemon, send a single request and return its result """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return request(sock, command, **params)
+    finally:
+        sock.close()
+
+
+class Provisioner(object):
+    """ The warm state shared by all the requests: templates and NetApp sessions
+
+    A session is used by one request at a time, and dropped when a request
+    fails on it so the next one reconnects. The templates are read again
+    when their files change.
+    """
+
+    def __init__(self):
+        self.templates = create_inventory.TemplateSet()
+        self.lock = threading.Lock()
+        # key -> (backend, lock)
+        self.backends = {}
+
+    def close(self):
+        with self.lock:
+            for backend, _ in self.backends.values():
+                backend.close()
+            self.backends = {}
+
+    def get_templates(self):
+        """ The loaded templates, reloaded first if they were edited """
+        with self.lock:
+            if self.templates.changed():
+                print("templates changed, reloading them", file=sys.stderr)
+                self.templates = create_inventory.TemplateSet()
+            return self.templates
+
+    def handle(self, request):
+        """ Run a request, return its result """
+        command = request.pop("command", None)
+        handler = getattr(self, "do_{0}".format(command), None)
+        if handler is None:
+            raise Exception("Unknown command {0}".format(command))
+        return handler(**request)
+
+    def _session(self, cache, key, connect):
+        with self.lock:
+            session = cache.get(key)
+            if session is None:
+                session = cache[key] = connect()
+        return session
+
+    def _drop_session(self, cache, key):
+        with self.lock:
+            return cache.pop(key, None)
+
+    def do_ping(self):
+        return "pong"
+
+    def do_inventory(self, spec):
+        """ Render an inventory from a create_inventory --batch spec, return it or its path """
+        args = create_inventory.build_parser().parse_args(create_inventory.spec_to_argv(spec))
+        master, infra_list, compute_list = create_inventory.validate_args(args)
+        templates = self.get_templates()
+        if "output" not in spec:
+            return create_inventory.render_inventory(master, infra_list, compute_list, args,
+                                                     templates)
+        with io.open(spec["output"], 'w', encoding='utf-8') as f:
+            create_inventory.write_inventory(f, master, infra_list, compute_list, args,
+                                             templates)
+            f.write('\n')
+        return spec["output"]
+
+    def do_lun_create(self, netapp, volume, name, size, initiators):
+        """ lun_manager.py --action create, return the LUN id """
+        if not lun_manager.size_pattern.match(size):
+            raise Exception("Invalid size {0} specified".format(size))
+        key = (netapp["backend"], netapp["server"], netapp["username"], netapp["vserver"])
+        backend, lock = self._session(self.backends, key,
+                                      lambda: (lun_manager.connect_backend(**netapp), threading.Lock()))
+        with lock:
+            try:
+                return lun_manager.ensure_lun(backend, volume, name, size, initiators)
+            except Exception:
+                if self._drop_session(self.backends, key) is not None:
+                    backend.close()
+                raise
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """ Serves the JSON lines requests of one client connection """
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            try:
+                response = {"result": self.server.provisioner.handle(json.loads(line.decode("utf-8")))}
+            except (Exception, SystemExit) as e:
+                response = {"error": "{0}".format(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, provisioner):
+        self.provisioner = provisioner
+        socketserver.UnixStreamServer.__init__(self, socket_path, RequestHandler)
+
+
+def serve(socket_path):
+    """ Serve requests on socket_path until interrupted """
+    if os.path.exists(socket_path):
+        try:
+            call(socket_path, "ping")
+            raise SystemExit("provisiond already listening on {0}".format(socket_path))
+        except socket.error:
+            # left behind by a daemon that didn't shut down cleanly
+            os.remove(socket_path)
+    socket_dir = os.path.dirname(socket_path)
+    if socket_dir and not os.path.isdir(socket_dir):
+        os.makedirs(socket_dir, 0o700)
+
+    def terminate(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, terminate)
+
+    provisioner = Provisioner()
+    # the socket is only usable by its owner
+    old_umask = os.umask(0o077)
+    try:
+        server = Server(socket_path, provisioner)
+    finally:
+        os.umask(old_umask)
+    print("provisiond listening on {0}".format(socket_path), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        provisioner.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resident provisioning service and its client')
+    parser.add_argument('mode', choices=["serve", "call"])
+    parser.add_argument('command', nargs='?', type=str, default="ping",
+                        help="Command to call (ping, inventory, lun_create)")
+    parser.add_argument('params', nargs='?', type=str, default="{}",
+                        help="JSON object with the command parameters")
+    parser.add_argument('--socket', nargs='?', type=str,
+                        default=os.environ.get(SOCKET_ENV_VAR, DEFAULT_SOCKET))
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        serve(args.socket)
+    else:
+        result = call(args.socket, args.command, **json.loads(args.params))
+        if isinstance(result, (dict, list)):
+            result = json.dumps(result, indent=1, sort_keys=True)
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
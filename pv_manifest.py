@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pv_manifest.py - Render the cluster PVs into one List manifest and apply it
+#
+# Copyright © 2018 Red Hat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import argparse
+import os
+import string
+import sys
+import node_prep
+
+# CONSTANTS
+
+PATH = os.path.dirname(os.path.abspath(__file__))
+NFS_PV_TEMPLATE_PATH = os.path.join(PATH, "pv-template.yaml")
+ISCSI_PV_TEMPLATE_PATH = os.path.join(PATH, "iscsi-pv-template.yaml")
+VOLUME_NAME_TEMPLATE = "vol-{0:03d}"
+APPLY_COMMAND = "oc create -f -"
+
+
+def volume_names(count):
+    return [VOLUME_NAME_TEMPLATE.format(i) for i in range(1, count + 1)]
+
+
+def create_export_dir(path):
+    """ Create an NFS export directory unless it exists """
+    if os.path.isdir(path):
+        print("directory '{0}' already exist , skipping ...".format(path), file=sys.stderr)
+        return
+    os.mkdir(path)
+
+
+def open_export_root(export_root):
+    """ Make everything under the export root writable by all, new or not (`chmod 777 *`) """
+    for name in os.listdir(export_root):
+        if not name.startswith("."):
+            os.chmod(os.path.join(export_root, name), 0o777)
+
+
+def render_nfs_pvs(template, volumes, export_base, nfs_server, export_root=None):
+    """ Yield a PV document per NFS volume
+
+    When export_root is set, the export directory of every volume is
+    created under it as the volume is rendered.
+    """
+    for volume in volumes:
+        if export_root is not None:
+            create_export_dir(os.path.join(export_root, volume))
+        yield (template.replace("#VOL_NAME#", volume)
+                       .replace("#EXPORT_BASE#", export_base)
+                       .replace("#NFS_SERVER#", nfs_server))
+
+
+def render_iscsi_pv(template, variables):
+    """ Render the iSCSI PV, ${NAME} placeholders are taken from `variables` """
+    return string.Template(template).safe_substitute(variables)
+
+
+def render_list(documents):
+    """ Wrap YAML documents into a single List manifest """
+    lines = ["apiVersion: v1", "kind: List", "items:"]
+    for document in documents:
+        prefix = "- "
+        for line in document.rstrip().splitlines():
+            lines.append(prefix + line if line else line)
+            prefix = "  "
+    return "\n".join(lines) + "\n"
+
+
+def apply_manifest(host, password, manifest):
+    """ Create all the objects of a manifest with a single remote `oc create` """
+    client = node_prep.ssh_connect(host, password)
+    try:
+        return node_prep.run_command(client, APPLY_COMMAND, stdin_data=manifest)
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the cluster PVs into one List manifest and apply it')
+
+    # NFS PVs
+    parser.add_argument('--volumes', nargs='?', type=int, default=0, help="Number of NFS PVs")
+    parser.add_argument('--nfs-server', nargs='?', type=str)
+    parser.add_argument('--export-base', nargs='?', type=str, help="Export path of the cluster volumes")
+    parser.add_argument('--export-root', nargs='?', type=str,
+                        help="Local (mounted) path of the cluster exports, to create the volume directories in")
+    parser.add_argument('--extra-dirs', nargs='?', type=str, default="",
+                        help="Other export directories to create under --export-root")
+
+    # iSCSI PV, see iscsi-pv-template.yaml for the environment variables it uses
+    parser.add_argument('--iscsi', action='store_true', help="Add the iSCSI PV (for Prometheus)")
+
+    parser.add_argument('--apply-host', nargs='?', type=str,
+                        help="Create the PVs on this master, print the manifest otherwise")
+    parser.add_argument('--root-password-env', nargs='?', type=str,
+                        default=node_prep.DEFAULT_ROOT_PASS_ENV_VAR,
+                        help="Env variable holding the master root password")
+    args = parser.parse_args()
+
+    if args.apply_host and args.root_password_env not in os.environ:
+        raise SystemExit("missing root password env var {0}".format(args.root_password_env))
+
+    if args.export_root:
+        for name in args.extra_dirs.split():
+            create_export_dir(os.path.join(args.export_root, name))
+
+    documents = []
+    if args.nfs_server:
+        if args.export_base is None:
+            raise SystemExit("--export-base is required for NFS PVs")
+        with open(NFS_PV_TEMPLATE_PATH, "r") as f:
+            template = f.read()
+        documents.extend(render_nfs_pvs(template, volume_names(args.volumes), args.export_base,
+                                        args.nfs_server, args.export_root))
+    elif args.export_root:
+        for volume in volume_names(args.volumes):
+            create_export_dir(os.path.join(args.export_root, volume))
+    if args.export_root:
+        # existing directories too, they may come from an earlier run
+        open_export_root(args.export_root)
+    if args.iscsi:
+        with open(ISCSI_PV_TEMPLATE_PATH, "r") as f:
+            documents.append(render_iscsi_pv(f.read(), os.environ))
+
+    if not documents:
+        return
+    manifest = render_list(documents)
+    if not args.apply_host:
+        sys.stdout.write(manifest)
+        return
+    print("Creating {0} PVs...".format(len(documents)), file=sys.stderr)
+    print(apply_manifest(args.apply_host, os.environ[args.root_password_env], manifest))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# test_events.py - cm_ovirt_vm_creator events mode, against a replayed event log
+#
+# Copyright © 2018 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import os
+import time
+import pytest
+
+sdk = pytest.importorskip("ovirtsdk4")
+import cm_ovirt_vm_creator  # noqa: E402
+import fake_engine  # noqa: E402
+import timing  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_engine_events.json")
+# the nodes the fixture has a lifecycle for, and their IPs
+NODES = {"replay-master001": "192.168.100.11", "replay-compute001": "192.168.100.12",
+         "replay-compute002": "192.168.100.13"}
+VMS_PATH = "GET " + fake_engine.API_PATH + "/vms"
+
+
+@pytest.fixture
+def new_engine():
+    """ Start fake engines replaying the fixture, stop them after the test """
+    servers = []
+
+    def start():
+        engine = fake_engine.FakeEngine(replay=fake_engine.load_replay(FIXTURE))
+        servers.append(fake_engine.start_server(engine))
+        engine.url = servers[-1].url
+        return engine
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_watcher_follows_the_replayed_log(new_engine):
+    engine = new_engine()
+    connection = sdk.Connection(url=engine.url, username="admin@internal", password="fake")
+    try:
+        watcher = cm_ovirt_vm_creator.EventWatcher(connection.system_service().events_service())
+        vm_id = engine.add_vm("replay-master001")["id"]
+        assert vm_id in watcher.poll()
+        # image locked until 2.1 seconds after the add, only other jobs' events meanwhile
+        time.sleep(1.5)
+        touched = watcher.poll()
+        assert vm_id not in touched
+        assert "foreign-ci42-compute003" in touched
+        time.sleep(1.0)
+        assert vm_id in watcher.poll()
+        assert engine.list_vms("name=replay-master001")[0]["status"] == fake_engine.STATUS_DOWN
+    finally:
+        connection.close()
+
+
+def run_creator(engine, monkeypatch, capsys, extra_args):
+    """ Create the fixture's nodes, return the number of status sweeps """
+    monkeypatch.setenv(cm_ovirt_vm_creator.ovirt_utils.DEFAULT_OVIRT_PASS_ENV_VAR, "fake")
+    monkeypatch.setenv(cm_ovirt_vm_creator.DEFAULT_OVIRT_PUB_SSHKEY_ENV_VAR, "ssh-rsa fake")
+    monkeypatch.setattr(cm_ovirt_vm_creator, "tracer", timing.Tracer())
+    args = cm_ovirt_vm_creator.build_parser().parse_args([
+        '--ovirt-url', engine.url, '--ovirt-user', 'admin@internal', '--ovirt-ca-pem-file', os.devnull,
+        '--ovirt-token-cache', '', '--ovirt-cluster', 'Default', '--ovirt-template', 'rhel',
+        '--name-prefix', 'replay', '--masters', '1', '--infra-nodes', '0', '--nodes', '2',
+        '--sleep-between-iterations', '1'] + extra_args)
+    cm_ovirt_vm_creator.run(args)
+    out = capsys.readouterr().out
+    assert 'MASTER_IP="{0}"'.format(NODES["replay-master001"]) in out
+    assert 'NODE_IPS="{0} {1}"'.format(NODES["replay-compute001"], NODES["replay-compute002"]) in out
+    return engine.requests[VMS_PATH]
+
+
+def test_events_mode_sweeps_less(new_engine, monkeypatch, capsys):
+    polling = run_creator(new_engine(), monkeypatch, capsys, [])
+    events = run_creator(new_engine(), monkeypatch, capsys, ["--use-events"])
+    # the VMs only change status a few times, but take seconds to do it
+    assert events < polling
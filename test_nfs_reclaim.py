@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# test_nfs_reclaim.py - nfs_reclaim planning and reclaim on a temporary export root
+#
+# Copyright © 2018 Red Hat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import os
+import pytest
+import nfs_reclaim
+
+
+def write_file(path, size):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+
+@pytest.fixture
+def export_root(tmpdir):
+    """ live/ and dead/ clusters, a kept directory, a hidden one and a plain file """
+    root = str(tmpdir)
+    for cluster in ("live", "dead", "keep-me", ".snapshot"):
+        os.makedirs(os.path.join(root, cluster, "vol-001"))
+    write_file(os.path.join(root, "dead", "vol-001", "data"), 1000)
+    os.makedirs(os.path.join(root, "dead", "registry", "docker"))
+    write_file(os.path.join(root, "dead", "registry", "docker", "layer"), 24)
+    write_file(os.path.join(root, "stray-file"), 10)
+    # a link out of the tree must not be followed when measuring or removing
+    outside = os.path.join(root, "live", "vol-001")
+    os.symlink(outside, os.path.join(root, "dead", "link"))
+    return root
+
+
+def test_plan_lists_only_dead_cluster_dirs(export_root):
+    plan = nfs_reclaim.plan_reclaim(export_root, {"live"}, keep={"keep-me"})
+    assert plan == [{"name": "dead", "path": os.path.join(export_root, "dead"), "size": None}]
+
+
+def test_plan_measures_trees(export_root):
+    plan = nfs_reclaim.plan_reclaim(export_root, {"live"}, keep={"keep-me"}, measure=True, workers=2)
+    assert plan[0]["size"] == 1024 + len(os.readlink(os.path.join(export_root, "dead", "link")))
+
+
+def test_run_plan_removes_trees_and_reports(export_root):
+    plan = nfs_reclaim.plan_reclaim(export_root, {"live"}, keep={"keep-me"}, measure=True)
+    missing = {"name": "gone", "path": os.path.join(export_root, "gone"), "size": None}
+    report = nfs_reclaim.run_reclaim_plan(plan + [missing], workers=2)
+    assert [(entry["name"], entry["ok"]) for entry in report] == [("dead", True), ("gone", False)]
+    assert sorted(os.listdir(export_root)) == [".snapshot", "keep-me", "live", "stray-file"]
+    # the link target survived
+    assert os.path.isdir(os.path.join(export_root, "live", "vol-001"))
+    assert nfs_reclaim.print_reclaim_report(report) == 1
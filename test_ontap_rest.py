@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# test_ontap_rest.py - ontap_rest.RestBackend against the fake_ontap stand-in
+#
+# Copyright © 2018 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import pytest
+import fake_ontap
+import lun_manager
+import ontap_rest
+
+VSERVER = "svm0"
+INITIATORS = ["iqn.1994-05.com.redhat:node1", "iqn.1994-05.com.redhat:node2"]
+
+
+@pytest.fixture
+def ontap():
+    ontap = fake_ontap.FakeOntap(VSERVER)
+    server = fake_ontap.start_server(ontap)
+    ontap.url = server.url
+    yield ontap
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def backend(ontap):
+    backend = ontap_rest.RestBackend(ontap.url, "admin", "secret", VSERVER)
+    yield backend
+    backend.close()
+
+
+def test_get_luns_follows_pages(ontap, backend, monkeypatch):
+    monkeypatch.setattr(ontap_rest, "PAGE_SIZE", 2)
+    for i in range(5):
+        ontap.add_lun("vol1", "cm-cluster{0}".format(i))
+    luns = backend.get_luns()
+    assert sorted(lun["name"] for lun in luns) == ["cm-cluster{0}".format(i) for i in range(5)]
+    assert ontap.requests["GET " + ontap_rest.LUNS_PATH] == 3
+
+
+def test_ensure_lun_creates_then_finds(ontap, backend):
+    lun_id = lun_manager.ensure_lun(backend, "vol1", "cm-test", "10gb", INITIATORS)
+    assert lun_id == "0"
+    assert [lun["name"] for lun in ontap.luns.values()] == ["/vol/vol1/cm-test"]
+    assert list(ontap.luns.values())[0]["space"]["size"] == 10 * 1024 ** 3
+    # a second run only reads the state, and adds the missing initiators
+    assert lun_manager.ensure_lun(backend, "vol1", "cm-test", "10gb", INITIATORS + ["iqn.new"]) == "0"
+    assert ontap.requests["POST " + ontap_rest.LUNS_PATH] == 1
+    igroup = list(ontap.igroups.values())[0]
+    assert set(i["name"] for i in igroup["initiators"]) == set(INITIATORS + ["iqn.new"])
+
+
+def test_reconcile_only_creates_missing_pieces(ontap, backend):
+    ontap.add_lun("vol1", "cm-a")
+    ontap.add_igroup("cm-a", INITIATORS)
+    ontap.map_lun("/vol/vol1/cm-a", "cm-a")
+    manifest = [{"name": "cm-a", "volume": "vol1", "size": "1gb", "initiators": INITIATORS},
+                {"name": "cm-b", "volume": "vol1", "size": "1gb", "initiators": INITIATORS}]
+    lun_ids, errors = lun_manager.reconcile(backend, manifest)
+    assert errors == {}
+    assert lun_ids == {"cm-a": "0", "cm-b": "1"}
+    assert ontap.requests["POST " + ontap_rest.LUNS_PATH] == 1
+    assert ontap.requests["POST " + ontap_rest.LUN_MAPS_PATH] == 1
+
+
+def test_cleanup_deletes_lun_igroup_and_mapping(ontap, backend):
+    lun_manager.ensure_lun(backend, "vol1", "cm-gone", "1gb", INITIATORS)
+    report = lun_manager.run_cleanup_plan(backend, [{"name": "cm-gone", "volume": "vol1"}])
+    assert report == [{"name": "cm-gone", "volume": "vol1", "ok": True}]
+    assert not ontap.luns and not ontap.igroups and not ontap.maps
+
+
+def test_post_is_not_sent_twice(ontap, backend):
+    # the LUN gets created, but the answer is lost
+    ontap.drop_after.add("POST")
+    with pytest.raises(Exception):
+        backend.create_lun("vol1", "cm-once", "1gb")
+    assert ontap.requests["POST " + ontap_rest.LUNS_PATH] == 1
+    assert len(ontap.luns) == 1
+
+
+def test_get_is_retried(ontap, backend):
+    ontap.add_lun("vol1", "cm-a")
+    ontap.drop_after.add("GET")
+    assert backend.get_luns() == [{"volume": "vol1", "name": "cm-a"}]
+    assert ontap.requests["GET " + ontap_rest.LUNS_PATH] == 2
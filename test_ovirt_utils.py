@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# test_ovirt_utils.py - cluster discovery while VMs come and go
+#
+# Copyright © 2018 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import fnmatch
+import re
+from collections import namedtuple
+import ovirt_utils
+
+Vm = namedtuple("Vm", ["name"])
+
+
+class ShrinkingVmsService(object):
+    """ Answers the engine searches, and removes a VM once the first page is read """
+
+    def __init__(self, names, removed_after_first_page):
+        self.names = sorted(names)
+        self.removed = removed_after_first_page
+
+    def list(self, search, max=None):
+        match = re.match("^name=(.*)$", search)
+        if match is not None:
+            return [Vm(name) for name in self.names if fnmatch.fnmatchcase(name, match.group(1))]
+        page = int(re.search("page ([0-9]+)", search).group(1))
+        vms = [Vm(name) for name in self.names[(page - 1) * max:page * max]]
+        if page == 1 and self.removed in self.names:
+            self.names.remove(self.removed)
+        return vms
+
+
+NAMES = ["a-master001", "a-master002", "b-master001", "c-master001", "c-master002"]
+
+
+def test_paged_scan_misses_a_cluster_the_name_query_finds():
+    # removing a-master001 shifts b-master001 onto the first page
+    service = ShrinkingVmsService(NAMES, "a-master001")
+    names = ovirt_utils.iter_vm_names(service, page_size=2)
+    clusters = set(ovirt_utils.match_vm_cluster(name) for name in names)
+    assert clusters == {"a", "c"}
+    assert ovirt_utils.find_live_clusters(service, {"b", "gone"} - clusters) == {"b"}
+
+
+def test_find_live_clusters_confirms_by_name():
+    service = ShrinkingVmsService(NAMES + ["bb-master001"], None)
+    assert ovirt_utils.find_live_clusters(service, ["b", "d", "bb"]) == {"b", "bb"}
+    # the prefix query also matches other clusters, they don't count
+    service = ShrinkingVmsService(["b-x-master001"], None)
+    assert ovirt_utils.find_live_clusters(service, ["b"]) == set()
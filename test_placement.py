@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# test_placement.py - cm_ovirt_vm_creator.plan_placement
+#
+# Copyright © 2018 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import pytest
+
+pytest.importorskip("ovirtsdk4")
+import cm_ovirt_vm_creator  # noqa: E402
+
+GIB = 1024 ** 3
+NODES = ["ocp-master001", "ocp-master002", "ocp-infra001", "ocp-compute001", "ocp-compute002"]
+
+
+def test_masters_and_infra_are_spread():
+    plan = cm_ovirt_vm_creator.plan_placement(NODES, {"sd1": 100 * GIB}, [("disk1", {"sd1"})], GIB)
+    spread = sorted(node for node, (anti_affinity, _) in plan.items() if anti_affinity)
+    assert spread == ["ocp-infra001", "ocp-master001", "ocp-master002"]
+
+
+def test_disks_go_to_the_domain_with_most_space_left():
+    available = {"sd1": 30 * GIB, "sd2": 50 * GIB}
+    plan = cm_ovirt_vm_creator.plan_placement(NODES, available, [("disk1", {"sd1", "sd2"})], 10 * GIB)
+    # sd2 until both have 30 GiB left, then one each
+    domains = [plan[node][1]["disk1"] for node in NODES]
+    assert domains[:2] == ["sd2", "sd2"]
+    assert sorted(domains[2:4]) == ["sd1", "sd2"]
+
+
+def test_disks_stay_on_the_domains_holding_the_template_disk():
+    # sd3 has the most space, but only holds the second disk of the template
+    available = {"sd1": 100 * GIB, "sd2": 100 * GIB, "sd3": 900 * GIB, "sd4": 900 * GIB}
+    template_disks = [("disk1", {"sd1", "sd2", "gone"}), ("disk2", {"sd3"})]
+    plan = cm_ovirt_vm_creator.plan_placement(NODES, available, template_disks, GIB)
+    for node in NODES:
+        assert plan[node][1]["disk1"] in ("sd1", "sd2")
+        assert plan[node][1]["disk2"] == "sd3"
+
+
+def test_no_active_domain_holds_the_template_disk():
+    with pytest.raises(Exception, match="No active data domain holds disk disk1"):
+        cm_ovirt_vm_creator.plan_placement(NODES, {"sd1": 100 * GIB}, [("disk1", {"inactive"})], GIB)
+
+
+def test_no_domain_has_room_left():
+    with pytest.raises(Exception, match="has room for 2 more disks"):
+        cm_ovirt_vm_creator.plan_placement(NODES, {"sd1": 3 * GIB}, [("disk1", {"sd1"})], GIB)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# timing.py - Lightweight timing spans for remote calls and run phases
+#
+# Copyright © 2018 Red Hat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, unicode_literals
+import contextlib
+import json
+import math
+import sys
+import time
+
+# CONSTANTS
+
+KIND_CALL = "call"
+KIND_PHASE = "phase"
+
+
+def percentile(sorted_values, pct):
+    """ Nearest-rank percentile of an already sorted list """
+    if not sorted_values:
+        return 0.0
+    rank = int(math.ceil(pct / 100.0 * len(sorted_values))) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+class Tracer(object):
+    """ Records (kind, name, start, duration) spans, relative to the tracer creation """
+
+    def __init__(self):
+        self.origin = time.time()
+        self.spans = []
+
+    def record(self, kind, name, started, ended=None):
+        """ Record a span that started (and ended) at the given time.time() values """
+        if ended is None:
+            ended = time.time()
+        self.spans.append((kind, name, started - self.origin, ended - started))
+
+    @contextlib.contextmanager
+    def span(self, kind, name):
+        """ Record the time spent in a `with` block """
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.record(kind, name, started)
+
+    def call(self, name):
+        """ Span of a single remote call """
+        return self.span(KIND_CALL, name)
+
+    def phase(self, name):
+        """ Span of a phase of the run """
+        return self.span(KIND_PHASE, name)
+
+    def stats(self):
+        """ Return {(kind, name): (count, p50, p95, max, total)} """
+        durations = {}
+        for kind, name, _, duration in self.spans:
+            durations.setdefault((kind, name), []).append(duration)
+        ret = {}
+        for key, values in durations.items():
+            values.sort()
+            ret[key] = (len(values), percentile(values, 50), percentile(values, 95),
+                        values[-1], sum(values))
+        return ret
+
+    def print_summary(self, out=sys.stderr):
+        """ Print a latency table, phases first """
+        stats = self.stats()
+        if not stats:
+            return
+        line = "{0:<6} {1:<32} {2:>6} {3:>9} {4:>9} {5:>9} {6:>10}"
+        print(line.format("kind", "name", "count", "p50", "p95", "max", "total"), file=out)
+        for kind in (KIND_PHASE, KIND_CALL):
+            for (span_kind, name), values in sorted(stats.items()):
+                if span_kind != kind:
+                    continue
+                count, p50, p95, max_, total = values
+                print(line.format(kind, name, count, "%.3f" % p50, "%.3f" % p95,
+                                  "%.3f" % max_, "%.3f" % total), file=out)
+
+    def write_json(self, path):
+        """ Write all the spans as a JSON trace """
+        trace = [{"kind": kind, "name": name, "start": start, "duration": duration}
+                 for kind, name, start, duration in self.spans]
+        with open(path, "w") as f:
+            json.dump({"origin": self.origin, "spans": trace}, f, indent=1)